@@ -0,0 +1,179 @@
+from gcp_utils import iter_query_chunks, prefetch_chunks, run_in_transaction, DEFAULT_BATCH_RETRIES, MAX_STATEMENT_PARAMS, logger
+from gcp_metrics import run_metrics
+import re
+import threading
+
+# Staging-side table recording when each table's delete sync last finished, so
+# the (full key scan) delete sync runs on its own, slower schedule
+DELETE_RUNS_TABLE = 'sync_delete_runs'
+
+CREATE_DELETE_RUNS_TABLE_QUERY = f"""
+CREATE TABLE IF NOT EXISTS {DELETE_RUNS_TABLE} (
+    table_name   text PRIMARY KEY,
+    deleted_rows bigint NOT NULL,
+    finished_at  timestamptz NOT NULL DEFAULT now()
+)
+"""
+
+SAVE_DELETE_RUN_QUERY = f"""
+INSERT INTO {DELETE_RUNS_TABLE} (table_name, deleted_rows, finished_at)
+VALUES (%s, %s, now())
+ON CONFLICT (table_name) DO UPDATE SET
+    deleted_rows = EXCLUDED.deleted_rows,
+    finished_at = EXCLUDED.finished_at
+"""
+
+# Hours between delete syncs of a table, primary keys fetched per page from
+# each side, and staging rows deleted per transaction
+DEFAULT_DELETE_INTERVAL_HOURS = 24
+DEFAULT_DELETE_KEY_PAGE = 50000
+DEFAULT_DELETE_BATCH_SIZE = 5000
+
+# Key types whose Postgres order Python comparison reproduces. Text keys are
+# ordered with the "C" collation (byte order) on both sides.
+ORDERED_KEY_TYPES = {
+    'smallint', 'integer', 'bigint', 'numeric', 'uuid', 'date',
+    'timestamp without time zone', 'timestamp with time zone',
+}
+TEXT_KEY_TYPES = {'text', 'character varying', 'character', 'name'}
+
+_ensured_engines = set()
+_ensure_lock = threading.Lock()
+
+def ensure_delete_runs_table(engine):
+    """Create the delete runs table once per engine (concurrent CREATE IF NOT EXISTS can race)"""
+    with _ensure_lock:
+        if id(engine) in _ensured_engines:
+            return
+        with engine.begin() as connection:
+            connection.exec_driver_sql(CREATE_DELETE_RUNS_TABLE_QUERY)
+        _ensured_engines.add(id(engine))
+
+def is_delete_sync_due(engine, table_name, interval_hours):
+    """Whether a table's last delete sync on this staging database finished at least interval_hours ago"""
+    ensure_delete_runs_table(engine)
+    with engine.connect() as connection:
+        due = connection.exec_driver_sql(
+            f"SELECT finished_at <= now() - %s * interval '1 hour' FROM {DELETE_RUNS_TABLE} WHERE table_name = %s",
+            (interval_hours, table_name)
+        ).scalar()
+    return due is None or due
+
+def base_type(column_type):
+    """Column type without typmods, e.g. 'timestamp(3) with time zone' -> 'timestamp with time zone'"""
+    return re.sub(r'\(.*?\)', '', column_type)
+
+def iter_primary_keys(engine, table_name, key_columns, key_types, page_size=DEFAULT_DELETE_KEY_PAGE):
+    """Stream a table's primary keys in ascending order as pages of tuples
+
+    Keys without text columns are paged by keyset on the primary key index,
+    each page a short query of its own. Text keys are ordered with the "C"
+    collation so Python compares them like Postgres does; the index cannot
+    serve that order, so they are sorted once and streamed through a
+    server-side cursor instead of being re-sorted for every page.
+    """
+    column_list = ', '.join(key_columns)
+    if any(base_type(key_types[col]) in TEXT_KEY_TYPES for col in key_columns):
+        order = ', '.join(f'{col} COLLATE "C"' if base_type(key_types[col]) in TEXT_KEY_TYPES else col for col in key_columns)
+        query = f"SELECT {column_list} FROM {table_name} ORDER BY {order}"
+        for chunk in iter_query_chunks(engine, query, chunk_size=page_size):
+            yield list(chunk.itertuples(index=False, name=None))
+        return
+
+    last_key = None
+    while True:
+        condition, params = 'TRUE', ()
+        if last_key is not None:
+            condition = f"({column_list}) > ({', '.join(['%s'] * len(key_columns))})"
+            params = last_key
+        query = f"SELECT {column_list} FROM {table_name} WHERE {condition} ORDER BY {column_list} LIMIT {int(page_size)}"
+        with engine.connect() as connection:
+            page = [tuple(row) for row in connection.exec_driver_sql(query, params).fetchall()]
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last_key = page[-1]
+
+def find_missing_keys(prod_pages, stage_pages):
+    """Merge-join two ascending primary key streams, yielding the staging keys absent from prod"""
+    prod_keys = (key for page in prod_pages for key in page)
+    prod_key = next(prod_keys, None)
+    for page in stage_pages:
+        for stage_key in page:
+            while prod_key is not None and prod_key < stage_key:
+                prod_key = next(prod_keys, None)
+            if prod_key != stage_key:
+                yield stage_key
+
+def delete_keys(cursor, table_name, key_columns, key_types, keys):
+    """Delete rows by primary key in one statement; returns the number of rows deleted"""
+    # Cast the VALUES rows to the key types, which untyped strings would not match (e.g. uuid)
+    template = '(' + ', '.join(f"CAST(%s AS {key_types[col]})" for col in key_columns) + ')'
+    cursor.execute(
+        f"DELETE FROM {table_name} WHERE ({', '.join(key_columns)}) IN (VALUES {', '.join([template] * len(keys))})",
+        tuple(value for key in keys for value in key)
+    )
+    return cursor.rowcount
+
+def sync_deletes(prod_engine, stage_engine, table_name, table_catalog, sync_config,
+                 max_retries=DEFAULT_BATCH_RETRIES):
+    """Delete staging rows whose primary key no longer exists in prod
+
+    Runs once the table's last delete sync on this staging database is
+    delete_interval_hours old. The primary keys of both sides are streamed
+    in ascending order and merge-joined, so memory stays at a page of keys
+    per side whatever the table size, and the missing keys are deleted in
+    batches, each in its own transaction. Returns the number of rows
+    deleted, or None when the sync was skipped.
+    """
+    primary_keys = list(table_catalog['primary_keys'])
+    key_types = {col['name']: col['type'] for col in table_catalog['columns']}
+    if not primary_keys:
+        logger.warning(f"Delete sync needs a primary key, skipping it for {table_name}")
+        return None
+    unsupported = [col for col in primary_keys if base_type(key_types[col]) not in ORDERED_KEY_TYPES | TEXT_KEY_TYPES]
+    if unsupported:
+        logger.warning(f"Delete sync cannot order primary key column(s) {', '.join(unsupported)}, skipping it for {table_name}")
+        return None
+
+    interval_hours = sync_config.get('delete_interval_hours', DEFAULT_DELETE_INTERVAL_HOURS)
+    if not is_delete_sync_due(stage_engine, table_name, interval_hours):
+        logger.debug(f"Delete sync of {table_name} ran less than {interval_hours}h ago, skipping it")
+        return None
+
+    page_size = sync_config.get('delete_key_page', DEFAULT_DELETE_KEY_PAGE)
+    batch_size = min(sync_config.get('delete_batch_size', DEFAULT_DELETE_BATCH_SIZE), MAX_STATEMENT_PARAMS // len(primary_keys))
+
+    def delete_batch(keys):
+        return run_in_transaction(
+            stage_engine, lambda cursor: delete_keys(cursor, table_name, primary_keys, key_types, keys),
+            f"{table_name} delete sync", max_retries, scope=table_name
+        )
+
+    try:
+        deleted_rows = 0
+        with run_metrics.span(table_name, 'delete_sync'):
+            # Prod keys are read ahead in a thread while staging keys are compared
+            prod_pages = prefetch_chunks(
+                iter_primary_keys(prod_engine, table_name, primary_keys, key_types, page_size), 1
+            )
+            stage_pages = iter_primary_keys(stage_engine, table_name, primary_keys, key_types, page_size)
+            batch = []
+            for key in find_missing_keys(prod_pages, stage_pages):
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    deleted_rows += delete_batch(batch)
+                    batch = []
+            if batch:
+                deleted_rows += delete_batch(batch)
+
+            with stage_engine.begin() as connection:
+                connection.exec_driver_sql(SAVE_DELETE_RUN_QUERY, (table_name, deleted_rows))
+
+        run_metrics.count(table_name, 'rows_deleted', deleted_rows)
+        logger.info(f"{table_name}: Delete sync removed {deleted_rows} rows missing in prod")
+        return deleted_rows
+    except Exception as e:
+        logger.error(f"Error syncing deletes for {table_name}: {str(e)}")
+        raise
@@ -1,6 +1,10 @@
 from gcp_utils import logger
-from gcp_sync_utils import sync_table, load_table_config
+from gcp_sync_utils import sync_table, SyncContext
+from gcp_scheduler import discover_dependencies, run_table_syncs, load_scheduler_limits
+from gcp_cdc import sync_cdc_tables
 from gcs_sync import sync_gcs_buckets
+from gcp_metrics import write_run_report
+from gcp_initial_load import restore_all_deferred_objects
 import os
 
 def run_gcs_syncs():
@@ -48,39 +52,59 @@ def run_all_syncs():
     logger.info("Starting all syncs...")
     
     try:
-        # Load all table configurations
-        tables = load_table_config()
-        success_status = {table_name: False for table_name in tables.keys()}
-        logger.debug(f"Tables: {tables}")
-        
-        # Group tables by service for better logging
-        service_tables = {}
-        for table_name, config in tables.items():
-            service = config['service']
-            if service not in service_tables:
-                service_tables[service] = []
-            service_tables[service].append(table_name)
-        
-        # Sync tables service by service
-        for service, table_list in service_tables.items():
-            logger.info(f"Starting sync for {service} service...")
+        # Config is parsed once and engines are shared by every table in the run
+        with SyncContext() as context:
+            # CDC tables replay the replication slot instead of polling their check column
+            tables = {
+                table_name: config for table_name, config in context.tables.items()
+                if config['sync_config'].get('mode') != 'cdc'
+            }
+            cdc_tables = {}
+            for table_name, config in context.tables.items():
+                if config['sync_config'].get('mode') == 'cdc':
+                    cdc_tables.setdefault(config['service'], []).append(table_name)
+            logger.debug(f"Tables: {tables}")
             
-            for table_name in table_list:
+            # Put back indexes and triggers an interrupted fast initial load left deferred
+            for service in {config['service'] for config in tables.values() if config['sync_config'].get('fast_initial_load')}:
                 try:
-                    logger.info(f"Starting sync for {table_name}...")
-                    sync_table(table_name)
-                    success_status[table_name] = True
-                    logger.info(f"{table_name} sync completed successfully")
+                    restore_all_deferred_objects(context.get_engine(f"{service}_stage"))
                 except Exception as e:
-                    logger.error(f"{table_name} sync failed: {str(e)}")
-                    if table_name != table_list[-1]:  # If not the last table in this service
-                        logger.error("Continuing with next table...")
+                    logger.warning(f"Could not restore deferred indexes and triggers of {service}: {str(e)}")
+            
+            # Each table touches its service's prod database and every staging target
+            table_databases = {
+                table_name: [
+                    f"{context.connections[db_key]['instance_connection_name']}/{context.connections[db_key]['database_name']}"
+                    for db_key in (f"{config['service']}_prod", *context.get_stage_targets(config['service']))
+                ]
+                for table_name, config in tables.items()
+            }
             
-            logger.info(f"Completed syncs for {service} service")
+            # Read foreign keys from staging so parents load before children
+            dependencies = discover_dependencies(tables, context)
+            
+            # Sync tables concurrently, isolating failures per table
+            success_status = run_table_syncs(
+                tables,
+                lambda table_name: sync_table(table_name, context),
+                dependencies,
+                table_databases,
+                **load_scheduler_limits()
+            )
+            
+            for service, table_names in cdc_tables.items():
+                success_status.update(sync_cdc_tables(context, service, table_names))
         
         # Run GCS syncs after database syncs
         gcs_success = run_gcs_syncs()
         
+        # Per-table and per-bucket-pair stage timings and counters, for comparing runs
+        try:
+            write_run_report()
+        except Exception as e:
+            logger.warning(f"Could not write the run report: {str(e)}")
+        
         # Report final status
         db_success = all(success_status.values())
         if db_success and gcs_success:
@@ -0,0 +1,180 @@
+from contextlib import contextmanager
+import copy
+import datetime
+import json
+import logging
+import os
+import re
+import resource
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Where the run report is written at the end of a run: a JSON document and, for
+# the node_exporter textfile collector, a Prometheus text-format file
+METRICS_REPORT_PATH = os.getenv('SYNC_METRICS_REPORT')
+METRICS_TEXTFILE_PATH = os.getenv('SYNC_METRICS_TEXTFILE')
+
+# Prefix of every exported Prometheus metric
+PROMETHEUS_PREFIX = 'db_sync'
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class RunMetrics:
+    """Timing spans, counters and gauges of one sync run, grouped by scope
+
+    A scope is a table name or a GCS bucket pair. Spans add up seconds and
+    calls per (scope, stage); spans of one stage running concurrently (range
+    partitions, copy workers) are summed, so stage time can exceed wall time.
+    Calls with scope None are ignored. Safe to use from any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far and restart the run clock"""
+        with self._lock:
+            self.started_at = time.time()
+            self._scopes = {}
+
+    def _scope(self, scope):
+        return self._scopes.setdefault(scope, {'status': None, 'stages': {}, 'counters': {}, 'gauges': {}})
+
+    def add_time(self, scope, stage, seconds):
+        """Add one timed call to a stage"""
+        if scope is None:
+            return
+        with self._lock:
+            entry = self._scope(scope)['stages'].setdefault(stage, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += 1
+
+    @contextmanager
+    def span(self, scope, stage):
+        """Time the enclosed block as one call of a stage, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(scope, stage, time.perf_counter() - start)
+
+    def count(self, scope, name, value=1):
+        """Increment a counter such as rows_loaded"""
+        if scope is None or not value:
+            return
+        with self._lock:
+            counters = self._scope(scope)['counters']
+            counters[name] = counters.get(name, 0) + value
+
+    def gauge(self, scope, name, value):
+        """Set a gauge such as peak_rss_bytes"""
+        if scope is None:
+            return
+        with self._lock:
+            self._scope(scope)['gauges'][name] = value
+
+    def observe_memory(self, scope):
+        """Record the process peak RSS reached by the time a scope finished"""
+        self.gauge(scope, 'peak_rss_bytes', peak_rss_bytes())
+
+    def set_status(self, scope, succeeded, error=None):
+        """Mark a scope as succeeded or failed"""
+        if scope is None:
+            return
+        with self._lock:
+            entry = self._scope(scope)
+            entry['status'] = 'succeeded' if succeeded else 'failed'
+            if error is not None:
+                entry['error'] = error
+
+    def report(self):
+        """Snapshot of the run as a JSON-serializable dict"""
+        finished_at = time.time()
+        with self._lock:
+            scopes = copy.deepcopy(self._scopes)
+        for entry in scopes.values():
+            for stage in entry['stages'].values():
+                stage['seconds'] = round(stage['seconds'], 3)
+        return {
+            'started_at': datetime.datetime.fromtimestamp(self.started_at, datetime.timezone.utc).isoformat(),
+            'finished_at': datetime.datetime.fromtimestamp(finished_at, datetime.timezone.utc).isoformat(),
+            'duration_seconds': round(finished_at - self.started_at, 3),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'scopes': scopes,
+        }
+
+# Metrics of the current run, shared by every module
+run_metrics = RunMetrics()
+
+def format_label(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def metric_name(name):
+    """Prefixed Prometheus metric name with invalid characters replaced"""
+    return f"{PROMETHEUS_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+def format_prometheus(report):
+    """Render a run report in the Prometheus text exposition format
+
+    Every value describes the last run, so all metrics are gauges.
+    """
+    samples = {}
+
+    def add(name, labels, value):
+        label_text = ','.join(f'{key}="{format_label(label)}"' for key, label in labels.items())
+        samples.setdefault(metric_name(name), []).append(f"{{{label_text}}} {value}" if label_text else f" {value}")
+
+    add('run_duration_seconds', {}, report['duration_seconds'])
+    add('run_peak_rss_bytes', {}, report['peak_rss_bytes'])
+    add('run_finished_timestamp_seconds', {}, int(time.time()))
+    for scope, entry in sorted(report['scopes'].items()):
+        if entry['status'] is not None:
+            add('success', {'scope': scope}, int(entry['status'] == 'succeeded'))
+        for stage, timing in sorted(entry['stages'].items()):
+            add('stage_seconds', {'scope': scope, 'stage': stage}, timing['seconds'])
+            add('stage_calls', {'scope': scope, 'stage': stage}, timing['calls'])
+        for name, value in sorted({**entry['counters'], **entry['gauges']}.items()):
+            add(name, {'scope': scope}, value)
+
+    lines = []
+    for name, values in samples.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{name}{value}" for value in values)
+    return '\n'.join(lines) + '\n'
+
+def write_atomically(path, content):
+    """Write a file through a temporary file, so readers never see a partial one"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+def write_run_report(report_path=METRICS_REPORT_PATH, textfile_path=METRICS_TEXTFILE_PATH):
+    """Log the slowest stages of the run and write the JSON report and Prometheus textfile"""
+    try:
+        report = run_metrics.report()
+        for scope, entry in sorted(report['scopes'].items()):
+            stages = sorted(entry['stages'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+            summary = ', '.join(f"{stage} {timing['seconds']:.1f}s" for stage, timing in stages[:4])
+            logger.info(f"Run report {scope} ({entry['status'] or 'unknown'}): {summary}")
+
+        if report_path:
+            write_atomically(report_path, json.dumps(report, indent=2, sort_keys=True))
+            logger.info(f"Wrote run report to {report_path}")
+        if textfile_path:
+            write_atomically(textfile_path, format_prometheus(report))
+            logger.info(f"Wrote Prometheus metrics to {textfile_path}")
+        return report
+    except Exception as e:
+        logger.error(f"Error writing run report: {str(e)}")
+        raise
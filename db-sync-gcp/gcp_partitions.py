@@ -0,0 +1,67 @@
+from gcp_utils import logger
+
+def get_histogram_cuts(engine, table_name, column, column_type, partitions, lower_bound=None):
+    """Pick partitions-1 cut points from the column's pg_stats histogram bounds"""
+    query = f"""
+    SELECT u.bound
+    FROM   pg_stats s,
+           unnest(s.histogram_bounds::text::text[]) WITH ORDINALITY AS u(bound, position)
+    WHERE  s.tablename = %s
+    AND    s.attname = %s
+    AND    s.schemaname = ANY(current_schemas(false))
+    {"AND    u.bound::" + column_type + " > %s" if lower_bound is not None else ""}
+    ORDER BY u.position
+    """
+    params = (table_name, column) if lower_bound is None else (table_name, column, str(lower_bound))
+
+    with engine.connect() as connection:
+        bounds = [row[0] for row in connection.exec_driver_sql(query, params)]
+
+    if len(bounds) < partitions:
+        return []
+    cuts = [bounds[len(bounds) * i // partitions] for i in range(1, partitions)]
+    return list(dict.fromkeys(cuts))
+
+def get_min_max_cuts(engine, table_name, column, partitions, lower_bound=None):
+    """Split the column's min/max range into equal-width partitions (numeric and temporal columns)"""
+    query = f"SELECT min({column}), max({column}) FROM {table_name}"
+    params = None
+    if lower_bound is not None:
+        query += f" WHERE {column} > %s"
+        params = (str(lower_bound),)
+
+    with engine.connect() as connection:
+        low, high = connection.exec_driver_sql(query, params).one()
+
+    if low is None or high is None or low == high:
+        return []
+    try:
+        cuts = [low + (high - low) * i / partitions for i in range(1, partitions)]
+    except TypeError:
+        logger.warning(f"Cannot split {table_name}.{column} by value range, loading it as one partition")
+        return []
+    if isinstance(low, int):
+        cuts = [int(cut) for cut in cuts]
+    return list(dict.fromkeys(cuts))
+
+def get_partition_ranges(engine, table_name, column, column_type, partitions, lower_bound=None):
+    """Split a table's key range on column into at most `partitions` [low, high) ranges
+
+    Cut points come from pg_stats histogram bounds, falling back to min/max
+    sampling when the column has no statistics. The first range is open below
+    and the last open above. Returns a single unbounded range when the table
+    cannot be split.
+    """
+    try:
+        cuts = get_histogram_cuts(engine, table_name, column, column_type, partitions, lower_bound)
+        if not cuts:
+            logger.info(f"No histogram bounds for {table_name}.{column}, sampling min/max instead")
+            cuts = get_min_max_cuts(engine, table_name, column, partitions, lower_bound)
+
+        edges = [None, *cuts, None]
+        ranges = list(zip(edges[:-1], edges[1:]))
+        logger.info(f"Split {table_name} into {len(ranges)} partitions on {column}")
+        return ranges
+    except Exception as e:
+        logger.error(f"Error computing partitions for {table_name}: {str(e)}")
+        raise
@@ -0,0 +1,116 @@
+from gcp_utils import logger
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import Counter
+import os
+
+# Concurrency caps, overridable through the environment
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_TABLES_PER_SERVICE = 2
+DEFAULT_MAX_TABLES_PER_DATABASE = 2
+
+def load_scheduler_limits():
+    """Read the scheduler concurrency caps from environment variables"""
+    return {
+        'max_workers': int(os.getenv('SYNC_MAX_WORKERS', DEFAULT_MAX_WORKERS)),
+        'max_tables_per_service': int(os.getenv('SYNC_MAX_TABLES_PER_SERVICE', DEFAULT_MAX_TABLES_PER_SERVICE)),
+        'max_tables_per_database': int(os.getenv('SYNC_MAX_TABLES_PER_DATABASE', DEFAULT_MAX_TABLES_PER_DATABASE)),
+    }
+
+def get_table_dependencies(catalog, table_names):
+    """Get foreign-key parents of each table (restricted to table_names) from the catalog"""
+    dependencies = {}
+    for table_name in table_names:
+        foreign_keys = catalog.get(table_name, {}).get('foreign_keys', [])
+        dependencies[table_name] = {
+            fk['parent_table'] for fk in foreign_keys
+            if fk['parent_table'] in table_names and fk['parent_table'] != table_name
+        }
+    logger.debug(f"Table dependencies: {dependencies}")
+    return dependencies
+
+def discover_dependencies(tables, context):
+    """Collect foreign-key dependencies for all configured tables, per service staging database"""
+    service_tables = {}
+    for table_name, config in tables.items():
+        service_tables.setdefault(config['service'], []).append(table_name)
+
+    dependencies = {}
+    for service, table_list in service_tables.items():
+        try:
+            dependencies.update(get_table_dependencies(context.get_catalog(f"{service}_stage"), table_list))
+        except Exception as e:
+            # Ordering is an optimization; without it tables still sync independently
+            logger.warning(f"Could not read foreign keys for {service} service, syncing without ordering: {str(e)}")
+    return dependencies
+
+def run_table_syncs(tables, sync_func, dependencies, table_databases,
+                    max_workers=DEFAULT_MAX_WORKERS,
+                    max_tables_per_service=DEFAULT_MAX_TABLES_PER_SERVICE,
+                    max_tables_per_database=DEFAULT_MAX_TABLES_PER_DATABASE):
+    """Sync tables concurrently in a worker pool, parents before children
+
+    A table starts once all of its foreign-key parents have finished and its
+    service and databases are below their concurrency caps. A failed table does
+    not stop the others. Returns {table_name: success}.
+    """
+    success_status = {table_name: False for table_name in tables.keys()}
+    pending = list(tables.keys())
+    finished = set()
+    running = {}
+    service_load = Counter()
+    database_load = Counter()
+    service_remaining = Counter(config['service'] for config in tables.values())
+
+    def has_capacity(table_name):
+        if len(running) >= max_workers:
+            return False
+        if service_load[tables[table_name]['service']] >= max_tables_per_service:
+            return False
+        return all(database_load[db] < max_tables_per_database for db in table_databases[table_name])
+
+    def parents_finished(table_name):
+        return dependencies.get(table_name, set()) <= finished
+
+    def start(executor, table_name):
+        failed_parents = [parent for parent in dependencies.get(table_name, set()) if parent in finished and not success_status[parent]]
+        if failed_parents:
+            logger.warning(f"Parent tables of {table_name} failed ({', '.join(failed_parents)}), syncing it anyway")
+        pending.remove(table_name)
+        service_load[tables[table_name]['service']] += 1
+        for db in table_databases[table_name]:
+            database_load[db] += 1
+        logger.info(f"Starting sync for {table_name}...")
+        running[executor.submit(sync_func, table_name)] = table_name
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for table_name in [name for name in pending if parents_finished(name)]:
+                if has_capacity(table_name):
+                    start(executor, table_name)
+
+            if not running:
+                # Nothing running and nothing startable means a foreign-key cycle
+                logger.warning(f"Foreign-key cycle among {', '.join(pending)}, starting {pending[0]} without waiting for its parents")
+                start(executor, pending[0])
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                table_name = running.pop(future)
+                service = tables[table_name]['service']
+                service_load[service] -= 1
+                for db in table_databases[table_name]:
+                    database_load[db] -= 1
+                finished.add(table_name)
+
+                try:
+                    future.result()
+                    success_status[table_name] = True
+                    logger.info(f"{table_name} sync completed successfully")
+                except Exception as e:
+                    logger.error(f"{table_name} sync failed: {str(e)}")
+
+                service_remaining[service] -= 1
+                if service_remaining[service] == 0:
+                    logger.info(f"Completed syncs for {service} service")
+
+    return success_status
@@ -0,0 +1,159 @@
+from gcp_utils import RecordChunk, format_array_literal, logger
+from contextlib import contextmanager
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+# pyarrow is in the requirements; an install without it loads spill tables straight from prod
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+# Directory holding one Arrow IPC file per table and starting watermark
+SPILL_DIR = os.getenv('SYNC_SPILL_DIR', os.path.join(os.getenv('SYNC_CACHE_DIR', '.sync_cache'), 'spill'))
+
+# Spill files are evicted oldest first beyond this total size, and never
+# replayed once older than this (prod may have changed since)
+DEFAULT_SPILL_MAX_MB = 4096
+SPILL_MAX_AGE_HOURS = 24
+
+# Buffer compression of the IPC files
+SPILL_COMPRESSION = 'zstd'
+
+# Spill files being written or replayed by a running load, which eviction skips
+_spills_in_use = set()
+_spills_lock = threading.Lock()
+
+def spill_available():
+    """Whether pyarrow is installed"""
+    return pa is not None
+
+def spill_path(table_name, columns, watermark):
+    """Spill file of a table's rows past a watermark (None for a full load)
+
+    The name hashes the starting watermark and the column list, so a rerun
+    from the same cursor finds the file and a schema change never replays it.
+    """
+    key = json.dumps({
+        'columns': [(col['name'], col['type']) for col in columns],
+        'watermark': None if watermark is None else [str(watermark['check_value']), watermark['key_values']],
+    }, sort_keys=True, default=str)
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return os.path.join(SPILL_DIR, table_name, f"{digest}.arrow")
+
+def spill_schema(columns, integer_columns):
+    """Arrow schema of prepared records: integers stay int64, every other value is text"""
+    return pa.schema([
+        (col['name'], pa.int64() if col['name'] in integer_columns else pa.string()) for col in columns
+    ])
+
+def spill_value(value):
+    """Text form of a prepared value; arrays become Postgres array literals"""
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return format_array_literal(value)
+    return str(value)
+
+def write_spill(path, record_chunks, columns, integer_columns):
+    """Write prepared record chunks to a compressed Arrow IPC file, one record batch per chunk
+
+    The file and a sidecar holding each chunk's keyset cursor are written
+    under temporary names and renamed once extraction has finished, so only
+    complete spills are ever replayed. Returns the number of records spilled.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    schema = spill_schema(columns, integer_columns)
+    integer_positions = {i for i, col in enumerate(columns) if col['name'] in integer_columns}
+    watermarks = []
+    total_records = 0
+    try:
+        options = pa.ipc.IpcWriteOptions(compression=SPILL_COMPRESSION)
+        with pa.OSFile(f"{path}.partial", 'wb') as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+            for chunk in record_chunks:
+                if not chunk:
+                    continue
+                arrays = []
+                for i, values in enumerate(zip(*chunk)):
+                    values = values if i in integer_positions else [spill_value(value) for value in values]
+                    arrays.append(pa.array(values, type=schema.field(i).type))
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                watermark = getattr(chunk, 'watermark', None)
+                watermarks.append(None if watermark is None else {
+                    'check_value': str(watermark['check_value']),
+                    'key_values': [str(value) for value in watermark['key_values']],
+                })
+                total_records += len(chunk)
+
+        with open(f"{path}.partial.json", 'w') as f:
+            json.dump({'watermarks': watermarks, 'records': total_records}, f)
+        os.replace(f"{path}.partial", path)
+        os.replace(f"{path}.partial.json", f"{path}.json")
+        logger.info(f"Spilled {total_records} records to {path} ({os.path.getsize(path)} bytes)")
+        return total_records
+    except Exception as e:
+        logger.error(f"Error writing spill {path}: {str(e)}")
+        for partial in (f"{path}.partial", f"{path}.partial.json"):
+            if os.path.exists(partial):
+                os.remove(partial)
+        raise
+
+def is_replayable(path):
+    """Whether a complete spill exists and is recent enough to replay"""
+    return (os.path.exists(path) and os.path.exists(f"{path}.json")
+            and time.time() - os.path.getmtime(path) < SPILL_MAX_AGE_HOURS * 3600)
+
+def read_spill(path):
+    """Stream the record chunks of a spill file through a memory map, with their keyset cursors"""
+    with open(f"{path}.json") as f:
+        watermarks = json.load(f)['watermarks']
+    with pa.memory_map(path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            records = list(zip(*(column.to_pylist() for column in batch.columns)))
+            yield RecordChunk(records, watermarks[i])
+
+@contextmanager
+def spill_in_use(path):
+    """Keep a spill file from being evicted while the enclosed block writes or replays it"""
+    with _spills_lock:
+        _spills_in_use.add(path)
+    try:
+        yield
+    finally:
+        with _spills_lock:
+            _spills_in_use.discard(path)
+
+def remove_spills(table_name):
+    """Delete every spill of a table, e.g. once its load has committed"""
+    for path in glob.glob(os.path.join(SPILL_DIR, table_name, '*.arrow*')):
+        os.remove(path)
+
+def evict_spills(max_bytes=None):
+    """Delete the oldest spill files until their total size fits under max_bytes
+
+    Spills in use are counted but never deleted, so a single spill larger
+    than max_bytes outlives its own load.
+    """
+    if max_bytes is None:
+        max_bytes = int(os.getenv('SYNC_SPILL_MAX_MB', DEFAULT_SPILL_MAX_MB)) * 1024 * 1024
+    spills = sorted(glob.glob(os.path.join(SPILL_DIR, '*', '*.arrow')), key=os.path.getmtime)
+    total_bytes = sum(os.path.getsize(path) for path in spills)
+    with _spills_lock:
+        in_use = set(_spills_in_use)
+    for path in spills:
+        if total_bytes <= max_bytes:
+            break
+        if path in in_use:
+            continue
+        total_bytes -= os.path.getsize(path)
+        for stale in (path, f"{path}.json"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        logger.info(f"Evicted spill {path}")
@@ -1,13 +1,69 @@
-from gcp_utils import create_db_connections, batch_insert_with_progress, logger, parse_db_config
+from gcp_utils import create_db_engine, batch_insert_with_progress, copy_between, ChunkFanOut, copy_staging_table_name, counting_merge_query, record_merge_counts, run_in_transaction, DEFAULT_BATCH_RETRIES, iter_query_chunks, prefetch_chunks, RecordChunk, logger, parse_db_config
 import pandas as pd
+from gcp_metrics import run_metrics
+from gcp_catalog import load_catalog, get_table_catalog
+from gcp_watermarks import get_watermark, save_watermark, chunk_watermark
+from gcp_partitions import get_partition_ranges
+from gcp_spill import spill_available, spill_path, write_spill, read_spill, is_replayable, remove_spills, evict_spills, spill_in_use
+from gcp_deletes import sync_deletes
+from gcp_initial_load import is_table_empty, defer_indexes_and_triggers, restore_deferred_objects, INITIAL_LOAD_SETTINGS, DEFAULT_INDEX_BUILD_WORKERS
+from gcp_checksums import find_changed_keys, DEFAULT_CHECKSUM_FANOUT, DEFAULT_CHECKSUM_LEAF_ROWS
+from concurrent.futures import ThreadPoolExecutor
 import yaml
 import json
+import decimal
+import threading
+import time
+from google.cloud.sql.connector import Connector
 
-def load_table_config():
+# Staging load strategy: 'copy' streams rows through COPY into a temp table and
+# merges them with one INSERT ... SELECT, 'insert' is the row-batch INSERT fallback
+DEFAULT_LOAD_MODE = 'copy'
+DEFAULT_BATCH_SIZES = {'copy': 10000, 'insert': 1000}
+
+# Unless sync_config.batch_size pins it, the batch size adapts within these row
+# bounds so each batch takes about this long and carries at most this payload
+DEFAULT_BATCH_SIZE_LIMITS = {'copy': (1000, 200000), 'insert': (100, 10000)}
+DEFAULT_BATCH_TARGET_SECONDS = 0.5
+DEFAULT_BATCH_TARGET_MB = 8
+
+# How merges treat rows already in staging: 'update' rewrites them,
+# 'skip_unchanged' only updates rows whose values differ, and 'insert_only'
+# (append-only tables) leaves them alone
+DEFAULT_MERGE_MODE = 'update'
+MERGE_MODES = ('update', 'skip_unchanged', 'insert_only')
+
+# Types without an equality operator, compared as text by skip_unchanged
+TEXT_COMPARED_TYPES = {'json', 'xml'}
+
+# Extraction streams fixed-size chunks through a server-side cursor; the row count
+# shrinks further when needed to keep each chunk under the memory ceiling
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_MAX_CHUNK_MB = 64
+
+# Prepared chunks a reader thread keeps ready ahead of the staging writer, so
+# prod reads overlap staging writes (0 reads and writes in turn)
+DEFAULT_PIPELINE_DEPTH = 2
+
+# Passthrough loads pipe COPY output from prod into staging untouched; binary is
+# fastest, text also works across differing OIDs of user-defined types
+DEFAULT_PASSTHROUGH_FORMAT = 'binary'
+
+# Range-partitioned loads (sync_config.partitions > 1): workers per table and
+# per-partition retries with exponential backoff
+DEFAULT_PARTITION_WORKERS = 4
+DEFAULT_PARTITION_RETRIES = 2
+PARTITION_RETRY_BACKOFF_SECONDS = 5
+
+# Integer column types, compared without any '(precision,scale)' suffix
+INTEGER_TYPES = {'smallint', 'integer', 'bigint', 'smallserial', 'serial', 'bigserial'}
+
+def load_table_config(table_config=None):
     """Load table configurations from YAML file"""
     try:
         # Get the tables_config paths from DB_SECRET_INFO
-        _, table_config = parse_db_config()
+        if table_config is None:
+            _, table_config = parse_db_config()
 
         logger.debug(f"Table config: {table_config}")
         
@@ -27,6 +83,64 @@ def load_table_config():
         logger.error(f"Error loading table config: {str(e)}")
         raise
 
+class SyncContext:
+    """Run-scoped state shared by every table sync in a run
+
+    Parses DB_SECRET_INFO and the table YAMLs once, lazily creates one pooled
+    engine per database on first use, and routes every connection through a
+    single Cloud SQL Connector. close() disposes the engines and the Connector.
+    """
+
+    def __init__(self):
+        self.connections, table_config = parse_db_config()
+        self.tables = load_table_config(table_config)
+        self._connector = None
+        self._engines = {}
+        self._catalogs = {}
+        self._lock = threading.Lock()
+        self._catalog_lock = threading.Lock()
+
+    def get_engine(self, db_key):
+        """Get the engine for a database key such as 'inventory_prod', creating it on first use"""
+        with self._lock:
+            if db_key not in self._engines:
+                if self._connector is None:
+                    self._connector = Connector()
+                logger.debug(f"Creating engine for {db_key}")
+                self._engines[db_key] = create_db_engine(self.connections[db_key], self._connector)
+            return self._engines[db_key]
+
+    def get_catalog(self, db_key):
+        """Get the catalog of all configured tables of a database's service, loaded once per run"""
+        with self._catalog_lock:
+            if db_key not in self._catalogs:
+                # Extra staging targets share the catalog scope of their service's stage
+                service = self.connections[db_key].get('target_of', db_key).rsplit('_', 1)[0]
+                table_names = [name for name, config in self.tables.items() if config['service'] == service]
+                self._catalogs[db_key] = load_catalog(self.get_engine(db_key), db_key, table_names)
+            return self._catalogs[db_key]
+
+    def get_stage_targets(self, service):
+        """Staging database keys each table of a service is loaded into: '<service>_stage' first, then its db.targets"""
+        stage_key = f"{service}_stage"
+        return [stage_key, *(key for key, connection in self.connections.items() if connection.get('target_of') == stage_key)]
+
+    def close(self):
+        """Dispose all engines and close the Cloud SQL Connector"""
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines = {}
+            if self._connector is not None:
+                self._connector.close()
+                self._connector = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 def generate_column_list(columns):
     """Generate a comma-separated list of column names"""
     return ', '.join(col['name'] for col in columns)
@@ -55,256 +169,799 @@ def get_check_value(engine, table_name, config):
         logger.error(f"Error getting check value: {str(e)}")
         raise
 
-def extract_all_data(engine, table_name, columns):
-    """Extract all data from the specified table"""
+def get_start_watermark(engine, table_name, config, key_columns):
+    """Keyset cursor a staging database resumes the table from
+
+    Without a stored cursor, bootstraps one from the latest check value in
+    staging (key_values None), or returns None for a full load.
+    """
+    check_column = config['sync_config']['check_column']
+    with run_metrics.span(table_name, 'watermark'):
+        watermark = get_watermark(engine, table_name, check_column, key_columns)
+
+    if watermark is not None:
+        logger.info(f"Resuming {table_name} after {check_column} {watermark['check_value']}, extracting new data...")
+    else:
+        # No cursor yet: bootstrap once from the latest check value in staging
+        check_value = get_check_value(engine, table_name, config)
+        logger.debug(f"Check value: {check_value}")
+        if check_value is None:
+            logger.info(f"No existing data found in {table_name}. Will copy all data from production...")
+        else:
+            logger.info(f"Found existing data in {table_name}, latest {check_column} is {check_value}, extracting new data from {table_name}...")
+            watermark = {'check_value': check_value, 'key_values': None}
+    return watermark
+
+def generate_range_condition(check_column, key_range, include_nulls=False):
+    """Generate a condition restricting check_column to a [low, high) partition range"""
+    low, high = key_range
+    conditions = []
+    params = ()
+    if low is not None:
+        conditions.append(f"{check_column} >= %s")
+        params += (low,)
+    if high is not None:
+        conditions.append(f"{check_column} < %s")
+        params += (high,)
+
+    condition = ' AND '.join(conditions) or 'TRUE'
+    if include_nulls and low is None:
+        # Rows without a check value belong to the first partition of a full load
+        condition = f"({condition} OR {check_column} IS NULL)"
+    return condition, params
+
+def generate_watermark_condition(check_column, watermark, key_columns):
+    """Generate the condition selecting rows past a watermark (see extract_new_data)"""
+    if watermark['key_values'] is not None:
+        order_columns = [check_column, *key_columns]
+        placeholders = ', '.join(['%s'] * len(order_columns))
+        condition = f"({', '.join(order_columns)}) > ({placeholders})"
+        params = (watermark['check_value'], *watermark['key_values'])
+    else:
+        condition = f"{check_column} >= %s"
+        params = (watermark['check_value'],)
+    return condition, params
+
+def extract_all_data(engine, table_name, columns, key_range=None, check_column=None, order_by=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE, max_chunk_bytes=None):
+    """Stream all data (optionally one check_column key range) from the specified table as DataFrame chunks"""
     column_list = generate_column_list(columns)
+    condition, params = ('TRUE', ()) if key_range is None else generate_range_condition(
+        check_column, key_range, include_nulls=True
+    )
     query = f"""
     SELECT {column_list}
     FROM {table_name}
+    WHERE {condition}
     """
+    if order_by:
+        query += f"ORDER BY {order_by}\n"
     
     try:
-        df = pd.read_sql(query, engine)
-        logger.info(f"Extracted {len(df)} rows from {table_name}")
-        return df
+        total_rows = 0
+        for chunk in iter_query_chunks(engine, query, params, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes, scope=table_name):
+            total_rows += len(chunk)
+            yield chunk
+        logger.info(f"Extracted {total_rows} rows from {table_name}")
     except Exception as e:
         logger.error(f"Error extracting from {table_name}: {str(e)}")
         raise
 
-def extract_new_data(engine, table_name, columns, config, check_value):
-    """Extract new data from the specified table"""
+def extract_new_data(engine, table_name, columns, config, watermark, key_columns, key_range=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE, max_chunk_bytes=None):
+    """Stream rows past the watermark from the specified table as DataFrame chunks
+
+    With key values the watermark is an exclusive (check_column, *key_columns)
+    keyset cursor, so rows sharing a check value are neither missed nor re-read
+    and the scan is an index range scan in key order; key values are empty when
+    the check column is the whole primary key. A bootstrapped watermark
+    (key_values None) is inclusive on check_column alone. key_range further
+    restricts check_column to one [low, high) partition.
+    """
     column_list = generate_column_list(columns)
     check_column = config['sync_config']['check_column']
-    check_type = config['sync_config']['check_type']
+    order_columns = [check_column, *key_columns]
     
-    operator = '>' if check_type in ['id', 'timestamp'] else '>='
+    condition, params = generate_watermark_condition(check_column, watermark, key_columns)
+    if key_range is not None:
+        range_condition, range_params = generate_range_condition(check_column, key_range)
+        condition = f"{condition} AND {range_condition}"
+        params += range_params
     
     query = f"""
     SELECT {column_list}
     FROM {table_name}
-    WHERE {check_column} {operator} %s
+    WHERE {condition}
+    ORDER BY {', '.join(order_columns)}
     """
     
     try:
-        df = pd.read_sql(query, engine, params=(check_value,))
-        logger.info(f"Extracted {len(df)} new rows from {table_name}")
-        return df
+        total_rows = 0
+        for chunk in iter_query_chunks(engine, query, params, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes, scope=table_name):
+            total_rows += len(chunk)
+            yield chunk
+        logger.info(f"Extracted {total_rows} new rows from {table_name}")
     except Exception as e:
         logger.error(f"Error extracting new data from {table_name}: {str(e)}")
         raise
 
-def prepare_record(row, columns):
-    """Prepare a single record based on column configurations"""
-    values = []
+def extract_chunks(engine, table_name, columns, config, watermark, key_columns, key_range=None,
+                   ordered=False, **chunk_options):
+    """Stream the rows to sync: everything without a watermark, otherwise the rows past it
+
+    Rows past a watermark always arrive in keyset order. ordered=True also
+    orders a full load (NULL check values first, since the cursor skips them),
+    which lets it commit resumable checkpoints part way through.
+    """
+    if watermark is None:
+        check_column = config['sync_config']['check_column']
+        order_by = None
+        if ordered:
+            # NULLS FIRST only where needed, so NOT NULL columns can still use their index order
+            nullable = next((col['nullable'] for col in columns if col['name'] == check_column), True)
+            order_by = ', '.join([f"{check_column} NULLS FIRST" if nullable else check_column, *key_columns])
+        return extract_all_data(engine, table_name, columns, key_range, check_column, order_by, **chunk_options)
+    return extract_new_data(engine, table_name, columns, config, watermark, key_columns, key_range, **chunk_options)
+
+def extract_rows_by_key(engine, table_name, columns, key_column, keys,
+                       chunk_size=DEFAULT_CHUNK_SIZE, max_chunk_bytes=None):
+    """Stream the rows with the given key values from the specified table as DataFrame chunks"""
+    column_list = generate_column_list(columns)
+    query = f"""
+    SELECT {column_list}
+    FROM {table_name}
+    WHERE {key_column} = ANY(%s)
+    """
+    
+    try:
+        for i in range(0, len(keys), chunk_size):
+            key_batch = keys[i:i + chunk_size]
+            yield from iter_query_chunks(
+                engine, query, (key_batch,), chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes, scope=table_name
+            )
+    except Exception as e:
+        logger.error(f"Error extracting changed rows from {table_name}: {str(e)}")
+        raise
+
+def normalize_json_text(value):
+    """Normalize a JSON string value, fixing common quoting issues"""
+    try:
+        # Fix single quotes to double quotes for JSON
+        if value.startswith("'{") and value.endswith("}'"):
+            # Remove outer single quotes if present
+            value = value[1:-1]
+        # Replace escaped single quotes with double quotes
+        value = value.replace("''", '"')
+        # Verify it's valid JSON
+        json.loads(value)
+        return value
+    except Exception as e:
+        logger.error(f"Error processing JSONB field: {str(e)}")
+        try:
+            # Second attempt: replace single quotes with double quotes, but preserve escaped ones
+            fixed_value = value.replace("'", '"').replace('""', "'")
+            json.loads(fixed_value)
+            return fixed_value
+        except Exception:
+            return None
+
+def convert_array_column(series, col):
+    """Arrays should already be lists; nulls and unexpected values become empty arrays"""
+    values = series.tolist()
+    unexpected = sum(1 for value in values if value is not None and not isinstance(value, list))
+    if unexpected:
+        logger.warning(f"Unexpected array value type for {col['name']} in {unexpected} rows")
+    return [value if isinstance(value, list) else [] for value in values]
+
+def convert_jsonb_column(series, col):
+    """Serialize JSON values to text, normalizing values that arrive as strings"""
+    return [
+        None if is_null
+        else normalize_json_text(value) if isinstance(value, str)
+        else json.dumps(value)
+        for value, is_null in zip(series.tolist(), series.isna().tolist())
+    ]
+
+def coerce_integer(value):
+    """Exact per-value integer conversion for columns that won't cast as a whole"""
+    if pd.isnull(value):
+        return None
+    try:
+        return int(decimal.Decimal(str(value)))
+    except (ArithmeticError, ValueError):
+        return None
+
+def convert_integer_column(series, col):
+    """Convert to exact integers via the nullable Int64 dtype (no float round trip)"""
+    try:
+        return series.astype('Int64').to_numpy(dtype=object, na_value=None).tolist()
+    except (TypeError, ValueError) as e:
+        logger.error(f"Error processing integer field {col['name']}: {str(e)}")
+        return [coerce_integer(value) for value in series.tolist()]
+
+def convert_text_column(series, col):
+    """Convert to stripped strings, keeping nulls as None"""
+    return series.astype(str).str.strip().where(series.notna(), None).tolist()
+
+def compile_column_converters(columns):
+    """Compile the table schema once into one converter function per column"""
+    converters = []
     for col in columns:
-        value = row[col['name']]
-        
-        # Handle null/empty checks based on type
+        base_type = col['type'].split('(')[0]
         if col['type'].startswith('ARRAY') or col['type'].endswith('[]'):
-            # Handle arrays - they should already be in list format
-            if value is None or (isinstance(value, list) and len(value) == 0):
-                values.append([])
-            elif isinstance(value, list):
-                values.append(value)
-            else:
-                logger.warning(f"Unexpected array value type for {col['name']}: {type(value)}")
-                values.append([])
-        elif pd.isnull(value):
-            values.append(None)
-        elif col['type'].startswith('jsonb'):
-            try:
-                if isinstance(value, str):
-                    # Fix single quotes to double quotes for JSON
-                    if value.startswith("'{") and value.endswith("}'"):
-                        # Remove outer single quotes if present
-                        value = value[1:-1]
-                    # Replace escaped single quotes with double quotes
-                    value = value.replace("''", '"')
-                    # Verify it's valid JSON
-                    json.loads(value)
-                    values.append(value)
-                else:
-                    # Convert dict/list to JSON string
-                    values.append(json.dumps(value))
-                    
-            except Exception as e:
-                logger.error(f"Error processing JSONB field: {str(e)}")
-                try:
-                    # Second attempt: try to fix common JSON formatting issues
-                    if isinstance(value, str):
-                        # Replace single quotes with double quotes, but preserve escaped ones
-                        fixed_value = value.replace("'", '"').replace('""', "'")
-                        # Verify and use the fixed JSON
-                        json.loads(fixed_value)
-                        values.append(fixed_value)
-                    else:
-                        values.append(None)
-                except Exception:
-                    values.append(None)
-        elif 'int' in col['type'] or col['type'] == 'bigserial':
-            try:
-                values.append(int(float(value)) if pd.notnull(value) else None)
-            except Exception as e:
-                logger.error(f"Error processing integer field: {str(e)}")
-                values.append(None)
+            converters.append(convert_array_column)
+        elif base_type.startswith('jsonb'):
+            converters.append(convert_jsonb_column)
+        elif base_type in INTEGER_TYPES:
+            converters.append(convert_integer_column)
         else:
-            try:
-                values.append(str(value).strip() if pd.notnull(value) else None)
-            except Exception as e:
-                logger.error(f"Error processing string field: {str(e)}")
-                values.append(None)
-    return tuple(values)
-
-def get_primary_keys(engine, table_name):
-    """Get primary key columns from the database"""
-    query = """
-    SELECT a.attname as column_name
-    FROM   pg_index i
-    JOIN   pg_attribute a ON a.attrelid = i.indrelid
-                        AND a.attnum = ANY(i.indkey)
-    WHERE  i.indrelid = %s::regclass
-    AND    i.indisprimary;
+            converters.append(convert_text_column)
+    return converters
+
+def prepare_chunk(chunk, columns, converters):
+    """Convert an extracted DataFrame chunk column-wise into insert-ready records"""
+    converted = [convert(chunk[col['name']], col) for col, convert in zip(columns, converters)]
+    return list(zip(*converted))
+
+def prepare_chunks(chunks, columns, check_column=None, key_columns=(), scope=None, ordered=False):
+    """Transform extracted DataFrame chunks into insert-ready record chunks
+
+    With a check_column, each chunk also carries the keyset cursor reached
+    after loading it; ordered says the rows arrive in keyset order. Preparation
+    time is recorded in the run metrics under scope.
     """
+    converters = compile_column_converters(columns)
+    watermark = None
+    for chunk in chunks:
+        with run_metrics.span(scope, 'prepare'):
+            if check_column is not None:
+                watermark = chunk_watermark(chunk, check_column, list(key_columns), watermark, ordered)
+            records = RecordChunk(prepare_chunk(chunk, columns, converters), watermark)
+        yield records
+
+def pipeline_chunks(chunks, columns, sync_config, table_name, check_column=None, key_columns=(), ordered=False):
+    """Prepare extracted chunks, ahead of the loader in a reader thread unless pipeline_depth is 0"""
+    record_chunks = prepare_chunks(chunks, columns, check_column, key_columns, scope=table_name, ordered=ordered)
+    depth = sync_config.get('pipeline_depth', DEFAULT_PIPELINE_DEPTH)
+    if depth <= 0:
+        return record_chunks
+    return prefetch_chunks(record_chunks, depth, scope=table_name)
+
+def get_batch_limits(sync_config, load_mode):
+    """Adaptive batch sizing bounds and targets for a table, or None when batch_size pins the size"""
+    if 'batch_size' in sync_config:
+        return None
+    min_size, max_size = DEFAULT_BATCH_SIZE_LIMITS[load_mode]
+    return {
+        'min_size': sync_config.get('batch_min_size', min_size),
+        'max_size': sync_config.get('batch_max_size', max_size),
+        'target_seconds': sync_config.get('batch_target_seconds', DEFAULT_BATCH_TARGET_SECONDS),
+        'target_bytes': sync_config.get('batch_target_mb', DEFAULT_BATCH_TARGET_MB) * 1024 * 1024
+    }
+
+def get_primary_keys(table_catalog, table_name):
+    """Get primary key columns from the table's catalog entry"""
+    primary_keys = list(table_catalog['primary_keys'])
     
-    try:
-        df = pd.read_sql(query, engine, params=(table_name,))
-        primary_keys = df['column_name'].tolist()
+    if not primary_keys:
+        logger.warning(f"No primary key found for table {table_name}")
+        # Use all columns as conflict key if no primary key defined
+        primary_keys = [col['name'] for col in table_catalog['columns']]
         
-        if not primary_keys:
-            logger.warning(f"No primary key found for table {table_name}")
-            # Use all columns as conflict key if no primary key defined
-            query_all_cols = """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name = %s
-            ORDER BY ordinal_position;
-            """
-            df_all = pd.read_sql(query_all_cols, engine, params=(table_name,))
-            primary_keys = df_all['column_name'].tolist()
-            
-        logger.debug(f"Using columns as conflict key for {table_name}: {', '.join(primary_keys)}")
-        return primary_keys
-    except Exception as e:
-        logger.error(f"Error getting primary keys for table {table_name}: {str(e)}")
-        raise
+    logger.debug(f"Using columns as conflict key for {table_name}: {', '.join(primary_keys)}")
+    return primary_keys
+
+def get_watermark_key_columns(table_catalog, check_column):
+    """Primary key columns that break ties on the check column in the keyset cursor"""
+    return [col for col in table_catalog['primary_keys'] if col != check_column]
+
+def generate_conflict_clause(table_name, columns, primary_keys, merge_mode=DEFAULT_MERGE_MODE):
+    """Generate the ON CONFLICT clause shared by the upsert and merge queries"""
+    if merge_mode not in MERGE_MODES:
+        raise ValueError(f"Unknown merge mode: {merge_mode}")
+    if len(primary_keys) == 0:
+        return ""
+
+    # Generate UPDATE SET clause excluding primary key columns
+    update_columns = [col for col in columns if col['name'] not in primary_keys]
+    update_clause = ', '.join(f"{col['name']} = EXCLUDED.{col['name']}" for col in update_columns)
+    if not update_columns or merge_mode == 'insert_only':
+        return f"ON CONFLICT ({', '.join(primary_keys)}) DO NOTHING"
 
-def generate_upsert_query(table_name, columns, primary_keys):
+    conflict_clause = f"""
+        ON CONFLICT ({', '.join(primary_keys)}) DO UPDATE SET
+            {update_clause}
+        """
+    if merge_mode == 'skip_unchanged':
+        # Identical rows are left alone: no new row version, WAL or dead tuple
+        def compared(prefix, col):
+            cast = '::text' if col.get('type', '').split('[')[0] in TEXT_COMPARED_TYPES else ''
+            return f"{prefix}.{col['name']}{cast}"
+        current = ', '.join(compared(table_name, col) for col in update_columns)
+        proposed = ', '.join(compared('EXCLUDED', col) for col in update_columns)
+        conflict_clause += f"""WHERE ({current}) IS DISTINCT FROM ({proposed})
+        """
+    return conflict_clause
+
+def generate_upsert_query(table_name, columns, primary_keys, merge_mode=DEFAULT_MERGE_MODE):
     """Generate INSERT or INSERT ON CONFLICT query based on configuration"""
     column_list = generate_column_list(columns)
 
-    if len(primary_keys) > 0:
-        # Generate UPDATE SET clause excluding primary key columns
-        update_columns = [col['name'] for col in columns if col['name'] not in primary_keys]
-        update_clause = ', '.join(f"{col} = EXCLUDED.{col}" for col in update_columns)
-        
-        return f"""
+    return f"""
         INSERT INTO {table_name} ({column_list})
         VALUES %s
-        ON CONFLICT ({', '.join(primary_keys)}) DO UPDATE SET
-            {update_clause}
+        {generate_conflict_clause(table_name, columns, primary_keys, merge_mode)}
         """
-    else:
-        return f"""
+
+def generate_merge_query(table_name, source_table, columns, primary_keys, merge_mode=DEFAULT_MERGE_MODE):
+    """Generate INSERT ... SELECT query merging a COPY staging table into the target"""
+    column_list = generate_column_list(columns)
+
+    return f"""
         INSERT INTO {table_name} ({column_list})
-        VALUES %s
+        SELECT {column_list} FROM {source_table}
+        {generate_conflict_clause(table_name, columns, primary_keys, merge_mode)}
         """
 
-def get_table_schema(engine, table_name, config):
-    """Get table schema information from the database"""
-    query = """
-    SELECT column_name, data_type, is_nullable, 
-           character_maximum_length, numeric_precision, numeric_scale,
-           udt_name
-    FROM information_schema.columns 
-    WHERE table_name = %s
-    ORDER BY ordinal_position;
-    """
+def get_table_schema(table_catalog, table_name, config):
+    """Get the synced columns from the table's catalog entry"""
+    # Get ignore columns from config
+    ignore_columns = config.get('sync_config', {}).get('ignore_columns', [])
     
-    try:
-        df = pd.read_sql(query, engine, params=(table_name,))
-        
-        # Get ignore columns from config
-        ignore_columns = config.get('sync_config', {}).get('ignore_columns', [])
-        
-        columns = []
-        for _, row in df.iterrows():
-            # Skip ignored columns
-            if row['column_name'] in ignore_columns and row['is_nullable'] == 'YES':
-                logger.info(f"Ignoring nullable column: {row['column_name']}")
-                continue
-                
-            # Rest of your existing column processing code
-            data_type = row['data_type']
-            if row['udt_name'].endswith('[]'):
-                data_type = f"{row['udt_name'][:-2]}[]"
-            elif row['character_maximum_length'] is not None:
-                data_type = f"{data_type}({row['character_maximum_length']})"
-            elif row['numeric_precision'] is not None and row['numeric_scale'] is not None:
-                data_type = f"{data_type}({row['numeric_precision']},{row['numeric_scale']})"
-            
-            columns.append({
-                'name': row['column_name'],
-                'type': data_type,
-                'nullable': row['is_nullable'] == 'YES'
-            })
-        
-        return columns
-    except Exception as e:
-        logger.error(f"Error getting schema for table {table_name}: {str(e)}")
-        raise
+    columns = []
+    for col in table_catalog['columns']:
+        # Skip ignored columns
+        if col['name'] in ignore_columns and col['nullable']:
+            logger.info(f"Ignoring nullable column: {col['name']}")
+            continue
+        columns.append(dict(col))
+    
+    logger.debug(f"Columns for {table_name}: {columns}")
+    return columns
+
+def load_partitions(prod_engine, table_name, columns, config, watermark, key_columns, key_ranges,
+                    chunk_options, load_options):
+    """Extract and load each key range in its own worker, with its own connections and retries
+
+    Partitions commit independently, so no partition stores the table's
+    watermark. Returns (loaded_records, furthest watermark reached) once every
+    partition has succeeded; raises the first failure otherwise.
+    """
+    sync_config = config['sync_config']
+    check_column = sync_config['check_column']
+    retries = sync_config.get('partition_retries', DEFAULT_PARTITION_RETRIES)
+    workers = min(len(key_ranges), sync_config.get('partition_workers', DEFAULT_PARTITION_WORKERS))
+
+    def load_partition(index, key_range):
+        label = f"{table_name} partition {index + 1}/{len(key_ranges)}"
+        reached = {}
+        for attempt in range(retries + 1):
+            try:
+                chunks = extract_chunks(
+                    prod_engine, table_name, columns, config, watermark, key_columns, key_range, **chunk_options
+                )
+                loaded_records = batch_insert_with_progress(
+                    record_chunks=pipeline_chunks(
+                        chunks, columns, sync_config, table_name, check_column, key_columns,
+                        ordered=watermark is not None
+                    ),
+                    checkpoint_func=lambda cursor, position: reached.update(position=position),
+                    label=label,
+                    **load_options
+                )
+                return loaded_records, reached.get('position')
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                delay = PARTITION_RETRY_BACKOFF_SECONDS * 2 ** attempt
+                run_metrics.count(table_name, 'retries')
+                logger.warning(f"{label} failed (attempt {attempt + 1}/{retries + 1}), retrying in {delay}s: {str(e)}")
+                time.sleep(delay)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(load_partition, index, key_range) for index, key_range in enumerate(key_ranges)]
+        results = []
+        errors = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(e)
+
+    if errors:
+        raise errors[0]
+
+    positions = [position for _, position in results if position is not None]
+    furthest = max(positions, key=lambda position: position['position']) if positions else None
+    return sum(loaded_records for loaded_records, _ in results), furthest
+
+def can_passthrough(sync_config, columns, stage_table_catalog):
+    """Whether a table can be loaded by COPY passthrough
+
+    The table must opt in with passthrough: true, since values are copied
+    verbatim without the regular path's conversions. Every synced column
+    must have the same type on staging, and the table must neither commit
+    in groups nor spill.
+    """
+    if not sync_config.get('passthrough', False) or sync_config.get('commit_every') is not None:
+        return False
+    if sync_config.get('spill') and spill_available():
+        return False
+    stage_types = {col['name']: col['type'] for col in stage_table_catalog['columns']}
+    return all(stage_types.get(col['name']) == col['type'] for col in columns)
+
+def load_passthrough(prod_engine, stage_engine, table_name, columns, config, watermark, key_columns,
+                     merge_query, max_retries=DEFAULT_BATCH_RETRIES, settings=()):
+    """Load the rows past the watermark by piping COPY output from prod straight into staging
+
+    Rows are streamed as COPY data (binary by default) from prod into a staging
+    temp table without being decoded in Python, then merged into the target.
+    The new keyset cursor is read from the temp table before the merge and
+    saved in the same transaction. settings are SET LOCAL statements run
+    first. Returns the number of records loaded.
+    """
+    sync_config = config['sync_config']
+    check_column = sync_config['check_column']
+    column_list = generate_column_list(columns)
+    staging_table = copy_staging_table_name(table_name)
+    copy_format = sync_config.get('passthrough_format', DEFAULT_PASSTHROUGH_FORMAT)
+    condition, params = ('TRUE', ()) if watermark is None else generate_watermark_condition(
+        check_column, watermark, key_columns
+    )
+    source_query = f"COPY (SELECT {column_list} FROM {table_name} WHERE {condition}) TO STDOUT (FORMAT {copy_format})"
+    order_columns = [check_column, *key_columns]
+
+    def load(cursor):
+        for setting in settings:
+            cursor.execute(setting)
+        cursor.execute(f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+        with run_metrics.span(table_name, 'passthrough'):
+            piped_bytes = copy_between(
+                prod_engine, source_query, params, cursor,
+                f"COPY {staging_table} ({column_list}) FROM STDIN (FORMAT {copy_format})", scope=table_name
+            )
+        run_metrics.count(table_name, 'bytes_sent', piped_bytes)
+
+        # Highest keyset position among the staged rows, plus their count
+        cursor.execute(f"""
+            SELECT {', '.join(order_columns)}, count(*) OVER ()
+            FROM {staging_table}
+            ORDER BY {', '.join(f"{column} DESC NULLS LAST" for column in order_columns)}
+            LIMIT 1
+            """)
+        row = cursor.fetchone()
+        if row is None:
+            return 0, 0, 0
+        with run_metrics.span(table_name, 'merge'):
+            cursor.execute(counting_merge_query(merge_query))
+            inserted, updated = cursor.fetchone()
+        if row[0] is not None:
+            with run_metrics.span(table_name, 'checkpoint'):
+                save_watermark(cursor, table_name, check_column, key_columns, {
+                    'check_value': row[0],
+                    'key_values': list(row[1:-1]),
+                })
+        logger.info(f"{table_name}: Passthrough loaded {row[-1]} records ({piped_bytes} bytes)")
+        return row[-1], inserted, updated
+
+    loaded_records, inserted, updated = run_in_transaction(stage_engine, load, f"{table_name} passthrough", max_retries, scope=table_name)
+    record_merge_counts(table_name, f"{table_name} passthrough", loaded_records, inserted, updated)
+    return loaded_records
+
+def spilled_chunks(table_name, columns, watermark, record_chunks):
+    """Route prepared record chunks through the table's on-disk spill
+
+    An earlier complete spill from the same watermark is replayed without
+    querying prod. Otherwise record_chunks (lazy, so prod is only read here)
+    are written to a new spill first, and loading then streams them back
+    from disk. The spill is held in use until the stream ends, so eviction by
+    this or a concurrent load never deletes it. Call remove_spills once the
+    load has committed.
+    """
+    path = spill_path(table_name, columns, watermark)
+    with spill_in_use(path):
+        if is_replayable(path):
+            logger.info(f"Replaying spilled rows of {table_name} from {path} without querying prod")
+            run_metrics.count(table_name, 'spill_replays')
+        else:
+            integer_columns = {col['name'] for col in columns if col['type'].split('(')[0] in INTEGER_TYPES}
+            with run_metrics.span(table_name, 'spill_write'):
+                write_spill(path, record_chunks, columns, integer_columns)
+            evict_spills()
+        yield from read_spill(path)
+
+def sync_changed_rows(prod_engine, stage_engine, table_name, columns, table_catalog, config,
+                      chunk_options, load_options):
+    """Copy only the rows that differ between prod and staging, located by a checksum diff
+
+    Catches updates to rows already behind the watermark. Needs a single
+    integer primary key; returns the number of rows copied.
+    """
+    sync_config = config['sync_config']
+    primary_keys = table_catalog['primary_keys']
+    key_type = next((col['type'] for col in columns if primary_keys and col['name'] == primary_keys[0]), '')
+    if len(primary_keys) != 1 or key_type.split('(')[0] not in INTEGER_TYPES:
+        logger.warning(f"Checksum diff needs a single integer primary key, skipping it for {table_name}")
+        return 0
+
+    key_column = primary_keys[0]
+    changed_keys, stage_only = find_changed_keys(
+        prod_engine, stage_engine, table_name, key_column, columns,
+        sync_config.get('checksum_fanout', DEFAULT_CHECKSUM_FANOUT),
+        sync_config.get('checksum_leaf_rows', DEFAULT_CHECKSUM_LEAF_ROWS)
+    )
+    if stage_only:
+        logger.warning(f"{stage_only} rows of {table_name} exist only in staging and were left in place")
+    if not changed_keys:
+        return 0
+
+    chunks = extract_rows_by_key(prod_engine, table_name, columns, key_column, changed_keys, **chunk_options)
+    return batch_insert_with_progress(
+        record_chunks=pipeline_chunks(chunks, columns, sync_config, table_name),
+        label=f"{table_name} diff",
+        **load_options
+    )
+
+def load_targets(prod_engine, targets, table_name, columns, table_catalog, config, watermark, key_columns,
+                 chunk_options, load_options):
+    """Load one prod extraction into several staging databases (fan-out)
+
+    targets maps staging databases to their engines, the primary stage
+    first; watermark is the primary stage's. Targets resuming from
+    the same watermark share a single extraction, fed to one loader thread
+    per target; each target commits and checkpoints on its own, so a
+    failing target does not hold up the others. Raises once every target
+    has finished if any failed; returns the number of records loaded.
+    """
+    sync_config = config['sync_config']
+    check_column = sync_config['check_column']
+    depth = sync_config.get('pipeline_depth', DEFAULT_PIPELINE_DEPTH)
+
+    # Targets that are behind each other need their own extraction
+    groups = {}
+    for index, (target, engine) in enumerate(targets.items()):
+        target_watermark = watermark if index == 0 else get_start_watermark(engine, table_name, config, key_columns)
+        group_key = json.dumps(target_watermark, sort_keys=True, default=str)
+        groups.setdefault(group_key, (target_watermark, []))[1].append(target)
+    if len(groups) > 1:
+        logger.info(f"Staging targets of {table_name} are at {len(groups)} different watermarks, extracting once per watermark")
+
+    loaded_records = 0
+    errors = {}
+    for watermark, group in groups.values():
+        chunks = extract_chunks(
+            prod_engine, table_name, columns, config, watermark, key_columns,
+            ordered=load_options['commit_every'] is not None, **chunk_options
+        )
+        fan_out = ChunkFanOut(
+            prepare_chunks(
+                chunks, columns, check_column, key_columns, scope=table_name,
+                ordered=watermark is not None or load_options['commit_every'] is not None
+            ),
+            len(group), depth, scope=table_name
+        )
+
+        def load_target(index, target):
+            engine = targets[target]
+            try:
+                target_records = batch_insert_with_progress(
+                    record_chunks=fan_out.stream(index),
+                    checkpoint_func=lambda cursor, position: save_watermark(
+                        cursor, table_name, check_column, key_columns, position
+                    ),
+                    label=f"{table_name} -> {target}",
+                    **{**load_options, 'engine': engine}
+                )
+            finally:
+                fan_out.detach(index)
+            # A bootstrapped cursor is persisted even when there was nothing new to load
+            if watermark is not None and watermark['key_values'] is None and not target_records:
+                with run_metrics.span(table_name, 'checkpoint'), engine.begin() as connection:
+                    save_watermark(connection.connection.cursor(), table_name, check_column, key_columns, watermark)
+            if sync_config.get('checksum_diff'):
+                with run_metrics.span(table_name, 'checksum_diff'):
+                    target_records += sync_changed_rows(
+                        prod_engine, engine, table_name, columns, table_catalog, config,
+                        chunk_options, {**load_options, 'engine': engine}
+                    )
+            return target_records
+
+        with ThreadPoolExecutor(max_workers=len(group)) as executor:
+            futures = {target: executor.submit(load_target, index, target) for index, target in enumerate(group)}
+            for target, future in futures.items():
+                try:
+                    loaded_records += future.result()
+                except Exception as e:
+                    logger.error(f"Loading {table_name} into {target} failed: {str(e)}")
+                    errors[target] = e
+        fan_out.join()
+
+    if errors:
+        raise RuntimeError(f"Loading {table_name} failed for staging targets: {', '.join(errors)}") from next(iter(errors.values()))
+    return loaded_records
+
+def sync_table(table_name, context=None):
+    """Sync a single table based on its configuration
+
+    Uses the run's SyncContext when given; otherwise a private context is
+    created and closed around this one table. Stage timings, counters and
+    the outcome are recorded in the run metrics under the table name.
+    """
+    owns_context = context is None
+    if owns_context:
+        context = SyncContext()
+    start = time.perf_counter()
 
-def sync_table(table_name):
-    """Sync a single table based on its configuration"""
     try:
-        # Load configuration
-        config = load_table_config()[table_name]
+        config = context.tables[table_name]
         service = config['service']  # Get the service name
 
         logger.debug(f"Config: {config}")
-        # Create database connections
-        engines = create_db_connections()
         
         # Use service-specific connection names
-        prod_engine = engines[f"{service}_prod"]
-        stage_engine = engines[f"{service}_stage"]
+        prod_engine = context.get_engine(f"{service}_prod")
+        stage_engine = context.get_engine(f"{service}_stage")
 
         logger.debug(f"Prod engine: {prod_engine}")
         logger.debug(f"Stage engine: {stage_engine}")
         
-        # Pass config to get_table_schema
-        columns = get_table_schema(prod_engine, table_name, config)
-        primary_keys = get_primary_keys(prod_engine, table_name)
+        # Schema and keys come from the run's cached catalog of the prod database
+        table_catalog = get_table_catalog(context.get_catalog(f"{service}_prod"), table_name)
+        columns = get_table_schema(table_catalog, table_name, config)
+        primary_keys = get_primary_keys(table_catalog, table_name)
         
-        # Get check value from staging
-        check_value = get_check_value(stage_engine, table_name, config)
-        logger.debug(f"Check value: {check_value}")
+        # Resume from the keyset cursor stored on staging
+        sync_config = config['sync_config']
+        check_column = sync_config['check_column']
+        key_columns = get_watermark_key_columns(table_catalog, check_column)
+        watermark = get_start_watermark(stage_engine, table_name, config, key_columns)
         
-        # Extract data based on check_value
-        if check_value is None:
-            logger.info(f"No existing data found in {table_name}. Will copy all data from production...")
-            df = extract_all_data(prod_engine, table_name, columns)
+        # Optionally split the check column's key range for parallel extract+load
+        key_ranges = [None]
+        if sync_config.get('partitions', 1) > 1:
+            column_type = next(col['type'] for col in columns if col['name'] == check_column)
+            key_ranges = get_partition_ranges(
+                prod_engine, table_name, check_column, column_type, sync_config['partitions'],
+                watermark['check_value'] if watermark is not None else None
+            )
+        
+        load_mode = sync_config.get('load_mode', DEFAULT_LOAD_MODE)
+        merge_mode = sync_config.get('merge_mode', DEFAULT_MERGE_MODE)
+        if load_mode == 'copy':
+            insert_query = generate_merge_query(
+                table_name, copy_staging_table_name(table_name), columns, primary_keys, merge_mode
+            )
         else:
-            logger.info(f"Found existing data in {table_name}, latest {config['sync_config']['check_column']} is {check_value}, extracting new data from {table_name}...")
-            df = extract_new_data(prod_engine, table_name, columns, config, check_value)
+            insert_query = generate_upsert_query(table_name, columns, primary_keys, merge_mode)
+        
+        # Extraction is lazy: chunks flow from prod through preparation into staging
+        chunk_options = {
+            'chunk_size': sync_config.get('chunk_size', DEFAULT_CHUNK_SIZE),
+            'max_chunk_bytes': sync_config.get('max_chunk_mb', DEFAULT_MAX_CHUNK_MB) * 1024 * 1024
+        }
+        load_options = {
+            'engine': stage_engine,
+            'insert_query': insert_query,
+            'batch_size': sync_config.get('batch_size', DEFAULT_BATCH_SIZES[load_mode]),
+            'batch_limits': get_batch_limits(sync_config, load_mode),
+            'load_mode': load_mode,
+            'table_name': table_name,
+            'column_names': [col['name'] for col in columns],
+            'commit_every': sync_config.get('commit_every'),
+            'max_retries': sync_config.get('batch_retries', DEFAULT_BATCH_RETRIES),
+            'settings': ()
+        }
         
         # Insert data into staging
-        if not df.empty:
-            insert_query = generate_upsert_query(table_name, columns, primary_keys)
-            
-            batch_insert_with_progress(
-                engine=stage_engine,
-                df=df,
-                insert_query=insert_query,
-                prepare_record_func=lambda row: prepare_record(row, columns)
-            )
+        stage_table_catalog = get_table_catalog(context.get_catalog(f"{service}_stage"), table_name)
+        stage_targets = context.get_stage_targets(service)
+        # Empty targets load without secondary indexes, triggers or synchronous commits
+        initial_load = (
+            sync_config.get('fast_initial_load') and len(stage_targets) == 1
+            and is_table_empty(stage_engine, table_name)
+        )
+        if initial_load:
+            defer_indexes_and_triggers(stage_engine, table_name)
+            load_options['settings'] = INITIAL_LOAD_SETTINGS
+        load_failed = False
+        try:
+            if len(stage_targets) > 1:
+                # One extraction feeds every staging target; each resolves and saves its own watermark
+                loaded_records = load_targets(
+                    prod_engine, {target: context.get_engine(target) for target in stage_targets},
+                    table_name, columns, table_catalog, config, watermark, key_columns, chunk_options, load_options
+                )
+                final_watermark = None
+            elif len(key_ranges) > 1:
+                loaded_records, reached = load_partitions(
+                    prod_engine, table_name, columns, config, watermark, key_columns, key_ranges,
+                    chunk_options, load_options
+                )
+                final_watermark = reached or watermark
+            elif can_passthrough(sync_config, columns, stage_table_catalog):
+                # Identical column types on both sides: pipe COPY data through untouched
+                loaded_records = load_passthrough(
+                    prod_engine, stage_engine, table_name, columns, config, watermark, key_columns,
+                    generate_merge_query(table_name, copy_staging_table_name(table_name), columns, primary_keys, merge_mode),
+                    load_options['max_retries'], load_options['settings']
+                )
+                bootstrapped = watermark is not None and watermark['key_values'] is None
+                final_watermark = watermark if bootstrapped and not loaded_records else None
+            else:
+                # Committing part way through needs a resumable row order
+                chunks = extract_chunks(
+                    prod_engine, table_name, columns, config, watermark, key_columns,
+                    ordered=load_options['commit_every'] is not None, **chunk_options
+                )
+                record_chunks = pipeline_chunks(
+                    chunks, columns, sync_config, table_name, check_column, key_columns,
+                    ordered=watermark is not None or load_options['commit_every'] is not None
+                )
+                spill = sync_config.get('spill') and spill_available()
+                if sync_config.get('spill') and not spill:
+                    logger.warning(f"Spill for {table_name} needs pyarrow, loading straight from prod")
+                if spill:
+                    record_chunks = spilled_chunks(table_name, columns, watermark, record_chunks)
+                loaded_records = batch_insert_with_progress(
+                    record_chunks=record_chunks,
+                    checkpoint_func=lambda cursor, position: save_watermark(
+                        cursor, table_name, check_column, key_columns, position
+                    ),
+                    **load_options
+                )
+                if spill:
+                    # Committed: the spill's starting cursor is behind the watermark now
+                    remove_spills(table_name)
+                # A bootstrapped cursor is persisted even when there was nothing new to load
+                bootstrapped = watermark is not None and watermark['key_values'] is None
+                final_watermark = watermark if bootstrapped and not loaded_records else None
+        except Exception:
+            load_failed = True
+            raise
+        finally:
+            if initial_load:
+                # Put back every deferred index and trigger even when the load failed
+                try:
+                    restore_deferred_objects(
+                        stage_engine, table_name, sync_config.get('index_build_workers', DEFAULT_INDEX_BUILD_WORKERS)
+                    )
+                except Exception:
+                    # The saved rows get the restore retried at the next startup; a
+                    # failed load keeps its own error rather than the restore's
+                    logger.error(f"{table_name}: Indexes and triggers left deferred until the next run")
+                    if not load_failed:
+                        raise
+        
+        if final_watermark is not None:
+            with run_metrics.span(table_name, 'checkpoint'), stage_engine.begin() as connection:
+                save_watermark(connection.connection.cursor(), table_name, check_column, key_columns, final_watermark)
+        
+        # Rows behind the watermark only change staging through a checksum diff
+        if sync_config.get('checksum_diff') and len(stage_targets) == 1:
+            with run_metrics.span(table_name, 'checksum_diff'):
+                loaded_records += sync_changed_rows(
+                    prod_engine, stage_engine, table_name, columns, table_catalog, config,
+                    chunk_options, load_options
+                )
+        
+        # Rows deleted in prod are removed from every staging target on their own, slower schedule
+        if sync_config.get('delete_sync'):
+            for target in stage_targets:
+                sync_deletes(prod_engine, context.get_engine(target), table_name, table_catalog, sync_config,
+                             load_options['max_retries'])
+        
+        if loaded_records:
             logger.info(f"Sync completed successfully for {table_name}")
         else:
             logger.info(f"No data to sync for {table_name}")
+        run_metrics.set_status(table_name, True)
         
     except Exception as e:
         logger.error(f"Sync failed for {table_name}: {str(e)}")
+        run_metrics.set_status(table_name, False, str(e))
         raise
     finally:
-        # Close all database connections
-        for engine in engines.values():
-            engine.dispose() 
\ No newline at end of file
+        run_metrics.add_time(table_name, 'total', time.perf_counter() - start)
+        run_metrics.observe_memory(table_name)
+        if owns_context:
+            context.close() 
\ No newline at end of file
@@ -1,7 +1,16 @@
 from sqlalchemy import create_engine
+from sqlalchemy.exc import DBAPIError
+from pg8000.exceptions import DatabaseError, InterfaceError
+from pg8000.native import literal
+from gcp_metrics import run_metrics
+import io
+import itertools
 import logging
+import pandas as pd
 import os
-from google.cloud.sql.connector import Connector
+import queue
+import threading
+import time
 import yaml
 
 # Configure logging
@@ -11,6 +20,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Rows fetched for the first chunk of a memory-bounded stream, used to measure row width
+PROBE_CHUNK_ROWS = 1000
+
+# Batch-level retries when loads commit in groups (commit_every), with exponential backoff
+DEFAULT_BATCH_RETRIES = 3
+BATCH_RETRY_BACKOFF_SECONDS = 2
+
+# Adaptive batch sizing: per-row cost is an exponentially weighted average of
+# the observed batches, estimated from this many sample rows before the first
+BATCH_SIZE_SAMPLE_ROWS = 100
+BATCH_COST_SMOOTHING = 0.3
+
+# Bind parameters the protocol allows in one statement
+MAX_STATEMENT_PARAMS = 65535
+
+# SQLSTATEs worth retrying: serialization failure, deadlock, server shutdown,
+# connection failures and too many connections
+TRANSIENT_SQLSTATES = {'40001', '40P01', '57P01', '57P02', '57P03', '08000', '08001', '08003', '08004', '08006', '53300'}
+
 # Parse DB_SECRET_INFO
 def parse_db_config():
     db_secret_info = os.getenv('DB_SECRET_INFO')
@@ -58,6 +86,21 @@ def parse_db_config():
                     'username': db_config['stage']['username'],
                     'password': db_config['stage']['password']
                 }
+            
+            # Add extra staging targets, loaded from the same prod extraction as stage (fan-out)
+            if db_config.get('targets') and 'stage' not in db_config:
+                raise ValueError(f"Service {service} lists staging targets without a stage database")
+            for target_name, target_config in db_config.get('targets', {}).items():
+                if target_name in ('prod', 'stage'):
+                    raise ValueError(f"Target name '{target_name}' of {service} is reserved")
+                logger.debug(f"Adding {target_name} target connection info for {service}")
+                connections[f"{service}_{target_name}"] = {
+                    'instance_connection_name': target_config['instance-connection-name'],
+                    'database_name': target_config['database-name'],
+                    'username': target_config['username'],
+                    'password': target_config['password'],
+                    'target_of': f"{service}_stage"
+                }
         
         logger.debug(f"Connections: {connections}")
         logger.debug(f"Table config: {table_config}")
@@ -70,80 +113,598 @@ def parse_db_config():
         logger.error(f"Error processing DB_SECRET_INFO: {str(e)}")
         raise
 
-def create_db_connections():
-    engines = {}
-    """Initialize Cloud SQL Python Connector object"""
-    connector = Connector()
-    
-    # Get database configurations
-    db_configs, _ = parse_db_config()
-    logger.debug(f"DB configs: {db_configs}")
-    
-    # Create connection functions for each database
-    def create_connection_func(config):
-        def get_conn():
-            return connector.connect(
-                config['instance_connection_name'],
-                "pg8000",
-                user=config['username'],
-                password=config['password'],
-                db=config['database_name']
-            )
-        return get_conn
-    
-    # Create engines for each database
-    for db_key, config in db_configs.items():
-        logger.debug(f"Creating engine for {db_key}")
-        engines[db_key] = create_engine(
-            "postgresql+pg8000://",
-            creator=create_connection_func(config),
-            pool_size=5,
-            max_overflow=2,
-            pool_timeout=30,
-            pool_recycle=1800,
+def create_db_engine(config, connector):
+    """Create a pooled engine for one database, connecting through the shared Cloud SQL Connector"""
+    def get_conn():
+        return connector.connect(
+            config['instance_connection_name'],
+            "pg8000",
+            user=config['username'],
+            password=config['password'],
+            db=config['database_name']
         )
-        
-    return engines
 
-def batch_insert_with_progress(engine, df, insert_query, prepare_record_func, batch_size=1000):
-    """Generic function to insert records in batches with progress tracking"""
+    return create_engine(
+        "postgresql+pg8000://",
+        creator=get_conn,
+        pool_size=5,
+        max_overflow=2,
+        pool_timeout=30,
+        pool_recycle=1800,
+    )
+
+def copy_staging_table_name(table_name):
+    """Name of the session temp table used to stage COPY loads for a table"""
+    return f"tmp_sync_{table_name}"
+
+def counting_merge_query(merge_query):
+    """Wrap an INSERT ... SELECT merge so it returns its (inserted, updated) row counts
+
+    xmax is 0 only on freshly inserted rows; rows skipped by the conflict
+    clause (DO NOTHING, or a DO UPDATE WHERE that did not match) are not
+    returned at all.
+    """
+    return f"""
+        WITH merged AS ({merge_query} RETURNING (xmax = 0) AS inserted)
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+        """
+
+def record_merge_counts(table_name, label, processed_records, inserted, updated):
+    """Record a committed load's inserted, updated and unchanged rows in the run metrics"""
+    unchanged = processed_records - inserted - updated
+    run_metrics.count(table_name, 'rows_loaded', processed_records)
+    run_metrics.count(table_name, 'rows_inserted', inserted)
+    run_metrics.count(table_name, 'rows_updated', updated)
+    run_metrics.count(table_name, 'rows_unchanged', unchanged)
+    logger.info(f"{label}: {inserted} inserted, {updated} updated, {unchanged} unchanged")
+
+def format_array_literal(values):
+    """Render a Python list as a Postgres array literal"""
+    items = []
+    for item in values:
+        if item is None:
+            items.append('NULL')
+        elif isinstance(item, list):
+            items.append(format_array_literal(item))
+        else:
+            item = str(item).replace('\\', '\\\\').replace('"', '\\"')
+            items.append(f'"{item}"')
+    return '{' + ','.join(items) + '}'
+
+def format_copy_value(value):
+    """Render a prepared value as a COPY text-format field"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, list):
+        value = format_array_literal(value)
+    else:
+        value = str(value)
+    return (value.replace('\\', '\\\\')
+                 .replace('\t', '\\t')
+                 .replace('\n', '\\n')
+                 .replace('\r', '\\r'))
+
+def format_copy_rows(batch):
+    """Render prepared records as a COPY text-format payload"""
+    return ''.join('\t'.join(format_copy_value(value) for value in record) + '\n' for record in batch)
+
+def copy_from_buffer(cursor, copy_sql, buffer):
+    """Stream a COPY ... FROM STDIN payload through a pg8000 cursor"""
+    cursor.execute(copy_sql, stream=buffer)
+
+def copy_to_stream(cursor, copy_sql, stream):
+    """Stream a COPY ... TO STDOUT result into a file object through a pg8000 cursor"""
+    cursor.execute(copy_sql, stream=stream)
+
+def render_query(cursor, query, params):
+    """Inline bind parameters into a statement that cannot take them, such as COPY"""
+    return query % tuple(literal(value) for value in params) if params else query
+
+class CountingReader(io.RawIOBase):
+    """Binary reader that counts the bytes read through it"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.raw.readinto(buffer)
+        self.bytes_read += count or 0
+        return count
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+def copy_between(source_engine, source_query, source_params, dest_cursor, dest_sql, scope=None):
+    """Pipe a COPY ... TO STDOUT on the source database into COPY ... FROM STDIN on dest_cursor
+
+    The source side runs in a writer thread on its own connection and feeds
+    an OS pipe that the destination COPY reads, so rows are never decoded in
+    Python. If either side fails the other is stopped and the error raised;
+    the destination's error wins, since a source failure surfaces there as
+    truncated input. Returns the number of bytes piped.
+    """
+    read_fd, write_fd = os.pipe()
+    reader = CountingReader(os.fdopen(read_fd, 'rb'))
+    writer = os.fdopen(write_fd, 'wb')
+    source_errors = []
+
+    def produce():
+        try:
+            with run_metrics.span(scope, 'connection_wait'):
+                connection = source_engine.connect()
+            with connection:
+                try:
+                    cursor = connection.connection.cursor()
+                    copy_to_stream(cursor, render_query(cursor, source_query, source_params), writer)
+                except Exception:
+                    # An interrupted COPY leaves the connection unusable
+                    connection.invalidate()
+                    raise
+        except Exception as e:
+            if not isinstance(e, BrokenPipeError):
+                logger.error(f"{scope}: COPY from source failed: {str(e)}")
+            source_errors.append(e)
+        finally:
+            try:
+                writer.close()
+            except OSError:
+                pass
+
+    producer = threading.Thread(target=produce, name=f"{scope or 'sync'}-copy", daemon=True)
+    producer.start()
+    dest_error = None
     try:
-        if df.empty:
-            logger.info("No records to insert")
+        copy_from_buffer(dest_cursor, dest_sql, reader)
+    except Exception as e:
+        dest_error = e
+    finally:
+        # Closing the read end stops a producer still writing
+        reader.close()
+        producer.join()
+
+    if dest_error is not None:
+        raise dest_error
+    if source_errors:
+        raise source_errors[0]
+    return reader.bytes_read
+
+def iter_query_chunks(engine, query, params=None, chunk_size=50000, max_chunk_bytes=None, scope=None):
+    """Stream query results through a server-side cursor as DataFrame chunks
+
+    Each chunk holds at most chunk_size rows. When max_chunk_bytes is set, the
+    fetch size is re-derived after every chunk from its measured footprint so
+    chunks stay under that memory ceiling however wide the rows are. Fetch time
+    and rows are recorded in the run metrics under scope.
+    """
+    fetch_size = chunk_size if max_chunk_bytes is None else min(chunk_size, PROBE_CHUNK_ROWS)
+    with run_metrics.span(scope, 'connection_wait'):
+        connection = engine.connect()
+    with connection:
+        with run_metrics.span(scope, 'extract'):
+            result = connection.execution_options(stream_results=True).exec_driver_sql(query, params)
+            columns = list(result.keys())
+        while True:
+            with run_metrics.span(scope, 'extract'):
+                rows = result.fetchmany(fetch_size)
+                if not rows:
+                    break
+
+                # Keep driver values as-is (no float coercion of nullable integers)
+                chunk = pd.DataFrame([tuple(row) for row in rows], columns=columns, dtype=object)
+            run_metrics.count(scope, 'rows_extracted', len(chunk))
+            yield chunk
+
+            if max_chunk_bytes:
+                row_bytes = max(1, int(chunk.memory_usage(deep=True).sum()) // len(chunk))
+                fetch_size = max(1, min(chunk_size, max_chunk_bytes // row_bytes))
+
+def prefetch_chunks(chunks, depth, scope=None):
+    """Produce chunks in a reader thread, up to depth chunks ahead of the consumer
+
+    The reader pulls the lazy extract-and-prepare stream through a bounded
+    queue, so reading from prod overlaps loading into staging and the queue
+    size provides backpressure. A reader error is re-raised in the consumer.
+    When the consumer stops early the reader is cancelled and the source
+    stream closed. Time the consumer waits for chunks is recorded in the run
+    metrics as pipeline_wait under scope.
+    """
+    chunk_queue = queue.Queue(maxsize=depth)
+    cancelled = threading.Event()
+    done = object()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                chunk_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        iterator = iter(chunks)
+        try:
+            for chunk in iterator:
+                if not put((chunk, None)):
+                    break
+        except Exception as e:
+            put((None, e))
+        finally:
+            # Release the source's connection from the thread that used it
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            put((done, None))
+
+    reader = threading.Thread(target=read, name=f"{scope or 'sync'}-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            with run_metrics.span(scope, 'pipeline_wait'):
+                chunk, error = chunk_queue.get()
+            if error is not None:
+                raise error
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        cancelled.set()
+        reader.join()
+
+class ChunkFanOut:
+    """Feeds every chunk of one stream to several consumers, each through its own bounded queue
+
+    A producer thread reads the source once, so the slowest active consumer
+    sets the pace. A consumer that stops, finished or failed, is detached
+    and no longer holds the others up. A source error is raised in every
+    active consumer.
+    """
+
+    def __init__(self, chunks, consumers, depth, scope=None):
+        self.queues = [queue.Queue(maxsize=max(1, depth)) for _ in range(consumers)]
+        self.active = set(range(consumers))
+        self._lock = threading.Lock()
+        self._done = object()
+        self._producer = threading.Thread(target=self._produce, args=(chunks,), name=f"{scope or 'sync'}-fanout", daemon=True)
+        self._producer.start()
+
+    def _active(self):
+        with self._lock:
+            return list(self.active)
+
+    def _put(self, index, item):
+        while index in self.active:
+            try:
+                self.queues[index].put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _produce(self, chunks):
+        iterator = iter(chunks)
+        try:
+            for chunk in iterator:
+                if not self.active:
+                    break
+                for index in self._active():
+                    self._put(index, (chunk, None))
+        except Exception as e:
+            for index in self._active():
+                self._put(index, (None, e))
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            for index in self._active():
+                self._put(index, (self._done, None))
+
+    def stream(self, index):
+        """The chunk stream of one consumer; detaches it when the consumer stops reading"""
+        try:
+            while True:
+                chunk, error = self.queues[index].get()
+                if error is not None:
+                    raise error
+                if chunk is self._done:
+                    return
+                yield chunk
+        finally:
+            self.detach(index)
+
+    def detach(self, index):
+        """Stop feeding a consumer"""
+        with self._lock:
+            self.active.discard(index)
+
+    def join(self):
+        """Wait for the producer to finish"""
+        self._producer.join()
+
+class RecordChunk(list):
+    """Prepared records of one extracted chunk plus the keyset cursor reached with it"""
+
+    def __init__(self, records, watermark=None):
+        super().__init__(records)
+        self.watermark = watermark
+
+class BatchSizer:
+    """Chooses the number of rows per staging batch
+
+    With a min_size below max_size the size adapts: it starts from the
+    estimated payload bytes per row and then follows the observed per-row load
+    latency, so each batch takes about target_seconds and carries at most
+    target_bytes. It grows at most 2x per batch. Equal bounds pin a fixed size.
+    """
+
+    def __init__(self, initial_size, min_size=None, max_size=None, target_seconds=None,
+                 target_bytes=None, label=None):
+        self.min_size = min_size or initial_size
+        self.max_size = max_size or initial_size
+        self.size = max(self.min_size, min(self.max_size, initial_size))
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.label = label
+        self.row_bytes = None
+        self.row_seconds = None
+        self.smallest = self.largest = self.size
+
+    @property
+    def adaptive(self):
+        return self.min_size < self.max_size
+
+    def fit(self, records):
+        """Size the first batch from the payload width of a sample of records"""
+        if not self.adaptive or self.row_bytes is not None or not records:
+            return
+        sample = records[:BATCH_SIZE_SAMPLE_ROWS]
+        self.row_bytes = max(1.0, len(format_copy_rows(sample)) / len(sample))
+        if self.target_bytes:
+            self._resize(self.target_bytes / self.row_bytes)
+
+    def observe(self, rows, seconds, payload_bytes=None):
+        """Feed back one loaded batch and resize the next one"""
+        if not self.adaptive or not rows:
             return
+        row_seconds = seconds / rows
+        self.row_seconds = row_seconds if self.row_seconds is None else (
+            BATCH_COST_SMOOTHING * row_seconds + (1 - BATCH_COST_SMOOTHING) * self.row_seconds
+        )
+        if payload_bytes:
+            self.row_bytes = payload_bytes / rows if self.row_bytes is None else (
+                BATCH_COST_SMOOTHING * payload_bytes / rows + (1 - BATCH_COST_SMOOTHING) * self.row_bytes
+            )
+
+        targets = []
+        if self.target_seconds and self.row_seconds > 0:
+            targets.append(self.target_seconds / self.row_seconds)
+        if self.target_bytes and self.row_bytes:
+            targets.append(self.target_bytes / self.row_bytes)
+        if targets:
+            self._resize(min(targets))
+
+    def _resize(self, target):
+        size = int(max(self.min_size, min(self.max_size, target, self.size * 2)))
+        if size != self.size and abs(size - self.size) >= self.size // 4:
+            row_ms = f"{self.row_seconds * 1000:.3f} ms/row" if self.row_seconds is not None else "no latency yet"
+            logger.info(f"{self.label}: Batch size {self.size} -> {size} (~{self.row_bytes:.0f} bytes/row, {row_ms})")
+        self.size = size
+        self.smallest = min(self.smallest, size)
+        self.largest = max(self.largest, size)
+
+def is_transient_error(error):
+    """Whether a load error is worth retrying: lost connections, deadlocks, serialization failures"""
+    if isinstance(error, DBAPIError):
+        if error.connection_invalidated:
+            return True
+        error = error.orig
+    if isinstance(error, (InterfaceError, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, DatabaseError) and error.args and isinstance(error.args[0], dict):
+        return error.args[0].get('C') in TRANSIENT_SQLSTATES
+    return False
+
+def run_in_transaction(engine, work, label, max_retries=0, retry_backoff=BATCH_RETRY_BACKOFF_SECONDS, scope=None):
+    """Run work(cursor) in its own transaction, retrying transient failures with exponential backoff
+
+    A failed attempt is rolled back as a whole, so work must be safe to repeat.
+    Connection waits and retries are recorded in the run metrics under scope.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            with run_metrics.span(scope, 'connection_wait'):
+                connection = engine.connect()
+            with connection:
+                try:
+                    with connection.begin():
+                        return work(connection.connection.cursor())
+                except Exception as e:
+                    if is_transient_error(e):
+                        # Never hand a possibly broken connection back to the pool
+                        connection.invalidate()
+                    raise
+        except Exception as e:
+            if attempt == max_retries or not is_transient_error(e):
+                raise
+            delay = retry_backoff * 2 ** attempt
+            run_metrics.count(scope, 'retries')
+            logger.warning(f"{label}: Transient error (attempt {attempt + 1}/{max_retries + 1}), retrying in {delay}s: {str(e)}")
+            time.sleep(delay)
+
+def iter_commit_groups(record_chunks, batch_sizer, commit_every):
+    """Group record chunks into commit units of at least commit_every batches
+
+    Batches are counted at the sizer's current size. Groups end on chunk
+    boundaries, where the keyset cursor is known.
+    """
+    group = []
+    batches = 0
+    for chunk in record_chunks:
+        group.append(chunk)
+        batches += -(-len(chunk) // batch_sizer.size)
+        if batches >= commit_every:
+            yield group
+            group = []
+            batches = 0
+    if group:
+        yield group
+
+def execute_values(cursor, insert_query, records):
+    """Run an INSERT ... VALUES %s query for many records, returning the rows of its RETURNING
+
+    Like psycopg2's execute_values(fetch=True): each page is one multi-row
+    VALUES statement, as large as the bind parameter limit allows.
+    """
+    row_placeholders = '(' + ','.join(['%s'] * len(records[0])) + ')'
+    page_size = max(1, MAX_STATEMENT_PARAMS // len(records[0]))
+    written = []
+    for start in range(0, len(records), page_size):
+        page = records[start:start + page_size]
+        cursor.execute(
+            insert_query % ','.join([row_placeholders] * len(page)),
+            tuple(value for record in page for value in record)
+        )
+        written.extend(cursor.fetchall())
+    return written
+
+def load_record_chunks(cursor, record_chunks, insert_query, batch_sizer, load_mode, table_name,
+                       column_names, checkpoint_func, label, settings=(), loaded_before=0):
+    """Load record chunks through a cursor inside the caller's transaction
+
+    settings (SET LOCAL statements) are applied first. Returns (records
+    processed, rows inserted, rows updated); records the conflict clause
+    skipped account for the difference.
+    """
+    for setting in settings:
+        cursor.execute(setting)
+    if load_mode == 'copy':
+        staging_table = copy_staging_table_name(table_name)
+        cursor.execute(
+            f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        copy_sql = f"COPY {staging_table} ({', '.join(column_names)}) FROM STDIN"
+
+    # Process each chunk in batches and report progress per chunk
+    processed_records = 0
+    inserted = updated = 0
+    watermark = None
+    for chunk in record_chunks:
+        batch_sizer.fit(chunk)
+        i = 0
+        while i < len(chunk):
+            batch = chunk[i:i + batch_sizer.size]
+            i += len(batch)
+            payload = None
+            start = time.perf_counter()
+            with run_metrics.span(table_name, 'load'):
+                if load_mode == 'copy':
+                    payload = format_copy_rows(batch)
+                    copy_from_buffer(cursor, copy_sql, io.StringIO(payload))
+                    run_metrics.count(table_name, 'bytes_sent', len(payload))
+                else:
+                    # One statement per batch, so the batch size sets the round trips
+                    written = execute_values(cursor, f"{insert_query} RETURNING (xmax = 0)", batch)
+                    batch_inserted = sum(1 for (is_insert,) in written if is_insert)
+                    inserted += batch_inserted
+                    updated += len(written) - batch_inserted
+            batch_sizer.observe(len(batch), time.perf_counter() - start, payload and len(payload))
+            run_metrics.count(table_name, 'batches')
+            processed_records += len(batch)
+
+        watermark = getattr(chunk, 'watermark', None) or watermark
+        logger.info(f"{label}: Progress: Processed {loaded_before + processed_records} records")
+
+    if load_mode == 'copy':
+        # Merge the staged rows into the target in a single statement
+        with run_metrics.span(table_name, 'merge'):
+            cursor.execute(counting_merge_query(insert_query))
+            inserted, updated = cursor.fetchone()
+
+    if checkpoint_func is not None and watermark is not None:
+        with run_metrics.span(table_name, 'checkpoint'):
+            checkpoint_func(cursor, watermark)
+
+    return processed_records, inserted, updated
+
+def batch_insert_with_progress(engine, record_chunks, insert_query, batch_size=1000,
+                               load_mode='insert', table_name=None, column_names=None,
+                               checkpoint_func=None, label=None, commit_every=None,
+                               max_retries=DEFAULT_BATCH_RETRIES, batch_limits=None, settings=()):
+    """Generic function to insert streamed records in batches with progress tracking
+
+    record_chunks is an iterable of prepared record lists. Chunks are consumed
+    as they arrive, so only the chunk being loaded is held in memory.
+
+    With load_mode='copy' the batches are streamed with COPY into a session temp
+    table and insert_query (an INSERT ... SELECT merge from that temp table) is
+    run at the end of each transaction. load_mode='insert' keeps the row-batch
+    INSERT path.
+
+    batch_size is used as is, unless batch_limits (BatchSizer min_size,
+    max_size, target_seconds and target_bytes) make it the starting point of an
+    adaptive size.
+
+    By default the whole load is one transaction. With commit_every, a
+    transaction is committed every commit_every batches (rounded up to whole
+    chunks); each such group is buffered and retried up to max_retries times
+    on transient errors. settings are SET LOCAL statements run at the start
+    of every transaction.
+
+    When chunks carry a watermark (RecordChunk), checkpoint_func(cursor, watermark)
+    is called with the last one inside each transaction, so the cursor is
+    committed atomically with the rows. label prefixes the progress logs
+    (defaults to table_name). Load, merge and connection wait times, batches,
+    bytes and committed rows (also split into inserted, updated and
+    unchanged) are recorded in the run metrics under table_name.
+    Returns the number of records loaded.
+    """
+    try:
+        if load_mode not in ('copy', 'insert'):
+            raise ValueError(f"Unknown load mode: {load_mode}")
+
+        label = label or table_name or 'staging'
+        chunk_iter = iter(record_chunks)
+        first_chunk = next(chunk_iter, None)
+        if not first_chunk:
+            logger.info(f"{label}: No records to insert")
+            return 0
             
-        total_records = len(df)
-        total_batches = (total_records + batch_size - 1) // batch_size
-        logger.info(f"Starting insert of {total_records} records (in {total_batches} batches)")
+        batch_sizer = BatchSizer(batch_size, label=label, **(batch_limits or {}))
+        logger.info(f"{label}: Starting {load_mode} of streamed records (in batches of "
+                    f"{f'{batch_sizer.min_size}-{batch_sizer.max_size}, adaptive' if batch_sizer.adaptive else batch_size})")
+        chunk_iter = itertools.chain([first_chunk], chunk_iter)
+        load_args = (insert_query, batch_sizer, load_mode, table_name, column_names, checkpoint_func, label, settings)
         
-        # Prepare data for insertion
-        insert_data = [prepare_record_func(row) for _, row in df.iterrows()]
+        if commit_every is None:
+            with run_metrics.span(table_name, 'connection_wait'):
+                connection = engine.connect()
+            with connection:
+                with connection.begin():
+                    processed_records, inserted, updated = load_record_chunks(connection.connection.cursor(), chunk_iter, *load_args)
+            record_merge_counts(table_name, label, processed_records, inserted, updated)
+        else:
+            processed_records = 0
+            for group in iter_commit_groups(chunk_iter, batch_sizer, commit_every):
+                committed_records, inserted, updated = run_in_transaction(
+                    engine,
+                    lambda cursor: load_record_chunks(cursor, group, *load_args, loaded_before=processed_records),
+                    label,
+                    max_retries,
+                    scope=table_name
+                )
+                processed_records += committed_records
+                record_merge_counts(table_name, label, committed_records, inserted, updated)
+                logger.info(f"{label}: Committed {processed_records} records")
         
-        with engine.connect() as connection:
-            with connection.begin():
-                cursor = connection.connection.cursor()
-                
-                # Process in batches and show progress every 10%
-                processed_records = 0
-                last_progress_report = 0
-                for i in range(0, len(insert_data), batch_size):
-                    batch = insert_data[i:i + batch_size]
-                    # Replace execute_values with pg8000's executemany
-                    placeholders = '(' + ','.join(['%s'] * len(batch[0])) + ')'
-                    formatted_query = insert_query % placeholders
-                    cursor.executemany(formatted_query, batch)
-                    
-                    processed_records += len(batch)
-                    progress = (processed_records / total_records) * 100
-                    
-                    # Only log every 10% progress
-                    if int(progress) // 10 > last_progress_report // 10:
-                        last_progress_report = int(progress)
-                        logger.info(f"Progress: {progress:.1f}% - Processed {processed_records}/{total_records} records")
-                
-                logger.info(f"Successfully inserted all {total_records} records into staging database")
+        if batch_sizer.adaptive:
+            logger.info(f"{label}: Batch sizes ranged {batch_sizer.smallest}-{batch_sizer.largest}, last {batch_sizer.size}")
+        run_metrics.gauge(table_name, 'batch_size', batch_sizer.size)
+        logger.info(f"{label}: Successfully inserted all {processed_records} records into staging database")
+        return processed_records
                 
     except Exception as e:
-        logger.error(f"Error inserting records: {str(e)}")
+        logger.error(f"Error inserting records into {table_name}: {str(e)}")
         logger.error(f"Error details - Type: {type(e).__name__}")
-        raise 
+        raise
@@ -0,0 +1,113 @@
+from gcp_utils import logger
+import json
+import threading
+
+# Staging-side table holding one keyset cursor per synced table. It lives in the
+# staging database so a cursor is committed in the same transaction as the rows.
+WATERMARK_TABLE = 'sync_watermarks'
+
+CREATE_WATERMARK_TABLE_QUERY = f"""
+CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+    table_name   text PRIMARY KEY,
+    check_column text NOT NULL,
+    check_value  text NOT NULL,
+    key_columns  jsonb NOT NULL,
+    key_values   jsonb,
+    updated_at   timestamptz NOT NULL DEFAULT now()
+)
+"""
+
+SAVE_WATERMARK_QUERY = f"""
+INSERT INTO {WATERMARK_TABLE} (table_name, check_column, check_value, key_columns, key_values, updated_at)
+VALUES (%s, %s, %s, CAST(%s AS jsonb), CAST(%s AS jsonb), now())
+ON CONFLICT (table_name) DO UPDATE SET
+    check_column = EXCLUDED.check_column,
+    check_value = EXCLUDED.check_value,
+    key_columns = EXCLUDED.key_columns,
+    key_values = EXCLUDED.key_values,
+    updated_at = EXCLUDED.updated_at
+"""
+
+_ensured_engines = set()
+_ensure_lock = threading.Lock()
+
+def ensure_watermark_table(engine):
+    """Create the watermark table once per engine (concurrent CREATE IF NOT EXISTS can race)"""
+    with _ensure_lock:
+        if id(engine) in _ensured_engines:
+            return
+        with engine.begin() as connection:
+            connection.exec_driver_sql(CREATE_WATERMARK_TABLE_QUERY)
+        _ensured_engines.add(id(engine))
+
+def get_watermark(engine, table_name, check_column, key_columns):
+    """Get the stored keyset cursor for a table
+
+    Returns {'check_value': str, 'key_values': list or None}, or None when no
+    cursor exists or it was recorded for a different check column / key.
+    key_values of None means the cursor is inclusive on check_value alone.
+    """
+    try:
+        ensure_watermark_table(engine)
+        with engine.connect() as connection:
+            row = connection.exec_driver_sql(
+                f"SELECT check_column, check_value, key_columns, key_values FROM {WATERMARK_TABLE} WHERE table_name = %s",
+                (table_name,)
+            ).mappings().first()
+
+        if row is None:
+            return None
+        if row['check_column'] != check_column or list(row['key_columns']) != list(key_columns):
+            logger.warning(f"Stored watermark for {table_name} uses a different check column or key, ignoring it")
+            return None
+
+        logger.debug(f"Watermark for {table_name}: {row['check_value']} / {row['key_values']}")
+        return {'check_value': row['check_value'], 'key_values': row['key_values']}
+    except Exception as e:
+        logger.error(f"Error getting watermark for {table_name}: {str(e)}")
+        raise
+
+def save_watermark(cursor, table_name, check_column, key_columns, watermark):
+    """Store a table's keyset cursor through a DB-API cursor, inside the caller's transaction"""
+    key_values = watermark['key_values']
+    cursor.execute(SAVE_WATERMARK_QUERY, (
+        table_name,
+        check_column,
+        str(watermark['check_value']),
+        json.dumps(list(key_columns)),
+        json.dumps([str(value) for value in key_values]) if key_values is not None else None,
+    ))
+
+def chunk_watermark(chunk, check_column, key_columns, current=None, ordered=False):
+    """Advance a keyset cursor past the rows of an extracted chunk
+
+    Returns the greatest (check_column, *key_columns) position seen so far;
+    rows with a NULL check value never move the cursor. When the rows arrive
+    in keyset order (ordered) the last one is taken, so text keys follow the
+    database collation rather than Python's string order.
+    """
+    rows = chunk[chunk[check_column].notna()]
+    if rows.empty:
+        return current
+
+    if ordered:
+        last = rows.iloc[-1]
+        top_keys = tuple(last[col] for col in key_columns)
+        return {
+            'position': (last[check_column], *top_keys),
+            'check_value': last[check_column],
+            'key_values': list(top_keys),
+        }
+
+    top_value = rows[check_column].max()
+    ties = rows[rows[check_column] == top_value]
+    top_keys = max(ties[key_columns].itertuples(index=False, name=None)) if key_columns else ()
+    candidate = (top_value, *top_keys)
+
+    if current is not None and current['position'] >= candidate:
+        return current
+    return {
+        'position': candidate,
+        'check_value': top_value,
+        'key_values': list(top_keys),
+    }
@@ -0,0 +1,166 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Directory holding one manifest per bucket pair; on Cloud Run it must be on a
+# mounted volume to survive between executions
+GCS_MANIFEST_DIR = os.getenv('GCS_MANIFEST_DIR', os.getenv('SYNC_CACHE_DIR', '.sync_cache'))
+
+# A warm manifest is trusted instead of listing the destination bucket until its
+# last full verification is this old
+DEFAULT_MANIFEST_MAX_AGE_HOURS = 24 * 7
+
+# Manifest rows are buffered and written in batches of this size
+MANIFEST_FLUSH_ROWS = 1000
+
+class ObjectInfo(NamedTuple):
+    """Listing metadata used to compare an object across buckets"""
+    name: str
+    size: int
+    md5_hash: Optional[str]
+    crc32c: Optional[str]
+    generation: int
+
+def object_info(blob) -> ObjectInfo:
+    """Extract comparison metadata from a listed or fetched blob"""
+    return ObjectInfo(blob.name, blob.size, blob.md5_hash, blob.crc32c, blob.generation)
+
+def same_content(source: ObjectInfo, dest: ObjectInfo) -> bool:
+    """Whether two objects hold the same bytes, by size and MD5 (CRC32C for composite objects)"""
+    if source.size != dest.size:
+        return False
+    if source.md5_hash and dest.md5_hash:
+        return source.md5_hash == dest.md5_hash
+    return bool(source.crc32c) and source.crc32c == dest.crc32c
+
+class SyncManifest:
+    """On-disk record of the source objects last synced for one bucket pair
+
+    Each row holds the source generation, size and hashes at the time the
+    object was copied or verified identical. A source object whose generation
+    still matches needs neither a destination lookup nor a copy.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._pending = []
+        self.run_id = int(time.time())
+        with self._lock:
+            self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                name            TEXT PRIMARY KEY,
+                generation      INTEGER NOT NULL,
+                size            INTEGER NOT NULL,
+                md5_hash        TEXT,
+                crc32c          TEXT,
+                dest_generation INTEGER,
+                run_id          INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key   TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rewrites (
+                name            TEXT PRIMARY KEY,
+                generation      INTEGER NOT NULL,
+                token           TEXT NOT NULL,
+                bytes_rewritten INTEGER NOT NULL,
+                total_bytes     INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """)
+
+    @classmethod
+    def for_pair(cls, source_bucket_name: str, dest_bucket_name: str) -> 'SyncManifest':
+        """Open the manifest of a bucket pair"""
+        file_name = re.sub(r'[^A-Za-z0-9_.-]', '_', f"gcs_{source_bucket_name}__{dest_bucket_name}.sqlite")
+        return cls(os.path.join(GCS_MANIFEST_DIR, file_name))
+
+    def is_warm(self, max_age_hours: float = DEFAULT_MANIFEST_MAX_AGE_HOURS) -> bool:
+        """Whether a full destination verification finished recently enough to trust the manifest"""
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = 'verified_at'").fetchone()
+        return row is not None and time.time() - float(row[0]) < max_age_hours * 3600
+
+    def get(self, name: str) -> Optional[ObjectInfo]:
+        """Get the source metadata recorded for an object when it was last synced"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT name, size, md5_hash, crc32c, generation FROM objects WHERE name = ?", (name,)
+            ).fetchone()
+        return ObjectInfo(*row) if row else None
+
+    def record(self, source: ObjectInfo, dest_generation: Optional[int] = None) -> None:
+        """Record a source object as synced (buffered; call flush() to persist)"""
+        with self._lock:
+            self._pending.append((
+                source.name, source.generation, source.size, source.md5_hash, source.crc32c,
+                dest_generation, self.run_id
+            ))
+            if len(self._pending) >= MANIFEST_FLUSH_ROWS:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        """Persist buffered records"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if self._pending:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending
+            )
+            self._connection.commit()
+            self._pending = []
+
+    def finish_verification(self) -> None:
+        """Mark a full verification against the destination listing as complete
+
+        Every object still in the source was recorded during the run, so rows
+        from earlier runs belong to deleted objects and are pruned.
+        """
+        with self._lock:
+            self._flush_locked()
+            self._connection.execute("DELETE FROM objects WHERE run_id <> ?", (self.run_id,))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('verified_at', ?)", (str(time.time()),)
+            )
+            self._connection.commit()
+
+    def get_rewrite_token(self, name: str, generation: int) -> Optional[str]:
+        """Get the saved rewrite token of an interrupted copy of this source generation"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT token FROM rewrites WHERE name = ? AND generation = ?", (name, generation)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_rewrite_token(self, name: str, generation: int, token: str,
+                           bytes_rewritten: int, total_bytes: int) -> None:
+        """Persist a rewrite token immediately, so the copy resumes after a crash"""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO rewrites VALUES (?, ?, ?, ?, ?)",
+                (name, generation, token, bytes_rewritten, total_bytes)
+            )
+            self._connection.commit()
+
+    def clear_rewrite_token(self, name: str) -> None:
+        """Forget the rewrite token of a finished or abandoned copy"""
+        with self._lock:
+            self._connection.execute("DELETE FROM rewrites WHERE name = ?", (name,))
+            self._connection.commit()
+
+    def close(self) -> None:
+        """Flush buffered records and close the database"""
+        self.flush()
+        with self._lock:
+            self._connection.close()
@@ -1,7 +1,14 @@
 from google.cloud import storage
+from google.api_core import exceptions as api_exceptions
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import logging
 import os
-from typing import List, Tuple, Dict
+import queue
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple, Dict
+from gcs_manifest import ObjectInfo, SyncManifest, object_info, same_content
+from gcp_metrics import run_metrics
 
 # Configure logging
 logging.basicConfig(
@@ -10,94 +17,442 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Copy concurrency, overridable through the environment. Workers are kept at or
+# below the HTTP connection pool size of the storage client (10 by default).
+DEFAULT_COPY_WORKERS = 8
+DEFAULT_COPY_RETRIES = 3
+COPY_RETRY_BACKOFF_SECONDS = 1
+DEFAULT_MAX_CONCURRENT_PAIRS = 2
+
+# Objects at least this large are copied with the resumable rewrite API by a
+# separate, smaller worker pool so they never hold up the small-object queue
+DEFAULT_REWRITE_THRESHOLD_MB = 256
+DEFAULT_LARGE_COPY_WORKERS = 2
+
+# Only the metadata needed for the diff is requested when listing
+LIST_FIELDS = 'items(name,size,md5Hash,crc32c,generation),nextPageToken'
+PREFIX_FIELDS = 'prefixes,nextPageToken'
+
+# Listing is sharded by '/' prefixes down to this depth and the shards are
+# listed and diffed in parallel; planned copies wait in a bounded queue
+DEFAULT_LIST_WORKERS = 8
+DEFAULT_LIST_PREFIX_DEPTH = 1
+COPY_QUEUE_SIZE = 10000
+
+# Errors worth retrying a copy for: throttling, server-side and network failures
+TRANSIENT_COPY_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    ConnectionError,
+    TimeoutError,
+)
+
 class GCSBucketSync:
-    def __init__(self, source_bucket_name: str, dest_bucket_name: str, dry_run: bool = False):
-        """Initialize GCS client and buckets"""
-        self.client = storage.Client()
+    def __init__(self, source_bucket_name: str, dest_bucket_name: str, dry_run: bool = False,
+                 client: Optional[storage.Client] = None,
+                 max_workers: int = int(os.getenv('GCS_COPY_WORKERS', DEFAULT_COPY_WORKERS)),
+                 max_retries: int = int(os.getenv('GCS_COPY_RETRIES', DEFAULT_COPY_RETRIES)),
+                 manifest: Optional[SyncManifest] = None,
+                 list_workers: int = int(os.getenv('GCS_LIST_WORKERS', DEFAULT_LIST_WORKERS)),
+                 list_depth: int = int(os.getenv('GCS_LIST_PREFIX_DEPTH', DEFAULT_LIST_PREFIX_DEPTH)),
+                 rewrite_threshold_mb: int = int(os.getenv('GCS_REWRITE_THRESHOLD_MB', DEFAULT_REWRITE_THRESHOLD_MB)),
+                 large_workers: int = int(os.getenv('GCS_LARGE_COPY_WORKERS', DEFAULT_LARGE_COPY_WORKERS))):
+        """Initialize GCS client, buckets and the pair's sync manifest
+
+        A client can be injected (e.g. one pointed at an emulator); the default
+        client honours STORAGE_EMULATOR_HOST.
+        """
+        self.client = client or storage.Client()
         self.source_bucket = self.client.bucket(source_bucket_name)
         self.dest_bucket = self.client.bucket(dest_bucket_name)
         self.dry_run = dry_run
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.list_workers = list_workers
+        self.list_depth = list_depth
+        self.rewrite_threshold = rewrite_threshold_mb * 1024 * 1024
+        self.large_workers = large_workers
+        self.manifest = manifest or SyncManifest.for_pair(source_bucket_name, dest_bucket_name)
+        # Run metrics scope of this bucket pair
+        self.scope = f"gcs:{source_bucket_name}->{dest_bucket_name}"
+        self._stats_lock = threading.Lock()
         logger.info(f"Initialized GCS sync between {source_bucket_name} and {dest_bucket_name}")
         if self.dry_run:
             logger.info("Running in DRY RUN mode - no files will be copied")
 
-    def get_existing_files(self, bucket):
-        """Get set of file paths in a bucket"""
-        return {blob.name for blob in bucket.list_blobs()}
+    def list_prefixes(self, bucket, prefix: str) -> List[str]:
+        """List the '/'-delimited sub-prefixes directly under prefix"""
+        iterator = bucket.list_blobs(prefix=prefix or None, delimiter='/', fields=PREFIX_FIELDS)
+        for _ in iterator.pages:
+            pass
+        return sorted(iterator.prefixes)
+
+    def list_shards(self) -> List[Tuple[str, bool]]:
+        """Split the source namespace into (prefix, delimited) listing shards
+
+        A delimited shard holds only the objects directly under its prefix;
+        the deepest prefixes are listed in full.
+        """
+        shards = []
+        prefixes = ['']
+        for _ in range(self.list_depth):
+            next_prefixes = []
+            for prefix in prefixes:
+                shards.append((prefix, True))
+                next_prefixes.extend(self.list_prefixes(self.source_bucket, prefix))
+            prefixes = next_prefixes
+        shards.extend((prefix, False) for prefix in prefixes)
+        return shards
+
+    def list_objects(self, bucket, prefix: str = '', delimited: bool = False) -> Iterator[ObjectInfo]:
+        """Stream the comparison metadata of a bucket's objects in name order"""
+        for blob in bucket.list_blobs(prefix=prefix or None, delimiter='/' if delimited else None, fields=LIST_FIELDS):
+            yield object_info(blob)
+
+    def copy_file(self, source: ObjectInfo, verify: bool = False) -> Tuple[bool, int]:
+        """Copy one object, retrying transient failures with exponential backoff
+
+        With verify, the destination object is fetched first and the copy is
+        skipped when it already holds the same content. Records the object in
+        the manifest and returns (copied, retries used).
+        """
+        if verify:
+            with run_metrics.span(self.scope, 'verify'):
+                dest_blob = self.dest_bucket.get_blob(source.name)
+            if dest_blob is not None and same_content(source, object_info(dest_blob)):
+                self.manifest.record(source, dest_blob.generation)
+                return False, 0
+
+        if source.size >= self.rewrite_threshold:
+            with run_metrics.span(self.scope, 'rewrite'):
+                return True, self.rewrite_file(source)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with run_metrics.span(self.scope, 'copy'):
+                    dest_blob = self.source_bucket.copy_blob(
+                        self.source_bucket.blob(source.name),
+                        self.dest_bucket,
+                        source.name
+                    )
+                self.manifest.record(source, getattr(dest_blob, 'generation', None))
+                return True, attempt
+            except TRANSIENT_COPY_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = COPY_RETRY_BACKOFF_SECONDS * 2 ** attempt
+                logger.warning(f"Copy of {source.name} failed (attempt {attempt + 1}/{self.max_retries + 1}), retrying in {delay}s: {str(e)}")
+                time.sleep(delay)
+
+    def rewrite_file(self, source: ObjectInfo) -> int:
+        """Copy a large object through the rewrite API, resuming from a saved token
+
+        Each rewrite call moves a slice of the object and returns a token for
+        the next one. Tokens are persisted in the manifest after every call, so
+        an interrupted copy continues where it stopped. Transient failures retry
+        the current call with exponential backoff; returns the retries used.
+        """
+        source_blob = self.source_bucket.blob(source.name, generation=source.generation)
+        dest_blob = self.dest_bucket.blob(source.name)
+        token = self.manifest.get_rewrite_token(source.name, source.generation)
+        if token:
+            logger.info(f"Resuming rewrite of {source.name}")
+
+        retries = 0
+        attempt = 0
+        while True:
+            try:
+                token, bytes_rewritten, total_bytes = dest_blob.rewrite(source_blob, token=token)
+            except api_exceptions.BadRequest as e:
+                if token is None:
+                    raise
+                # Saved tokens expire; start the copy over
+                logger.warning(f"Rewrite token for {source.name} rejected, restarting: {str(e)}")
+                self.manifest.clear_rewrite_token(source.name)
+                token = None
+                continue
+            except TRANSIENT_COPY_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = COPY_RETRY_BACKOFF_SECONDS * 2 ** attempt
+                logger.warning(f"Rewrite of {source.name} failed (attempt {attempt + 1}/{self.max_retries + 1}), retrying in {delay}s: {str(e)}")
+                attempt += 1
+                retries += 1
+                time.sleep(delay)
+                continue
+
+            attempt = 0
+            logger.info(f"Rewrite of {source.name}: {bytes_rewritten}/{total_bytes} bytes "
+                        f"({100 * bytes_rewritten // max(total_bytes, 1)}%)")
+            if token is None:
+                break
+            self.manifest.save_rewrite_token(source.name, source.generation, token, bytes_rewritten, total_bytes)
+
+        self.manifest.clear_rewrite_token(source.name)
+        self.manifest.record(source, dest_blob.generation)
+        return retries
+
+    def copy_files(self, copies: Iterable[Tuple[ObjectInfo, bool]], stats: dict) -> None:
+        """Copy objects through a bounded worker pool, recording results in stats
+
+        copies yields (source object, verify) pairs. At most a few small copies
+        per worker are in flight, so it may be a lazy stream; large objects go
+        to their own pool and do not count against that limit. A failed object
+        is counted and logged without stopping the others.
+        """
+        def record(future, source):
+            file_path = source.name
+            try:
+                copied, retries = future.result()
+                with self._stats_lock:
+                    stats['copied_files' if copied else 'verified_files'] += 1
+                    stats['retries'] += retries
+                    if copied:
+                        stats['copied_bytes'] += source.size
+                logger.debug(f"{'Copied' if copied else 'Already identical'}: {file_path}")
+            except Exception as e:
+                with self._stats_lock:
+                    stats['failed_files'] += 1
+                logger.error(f"Failed to copy {file_path}: {str(e)}")
+
+        max_in_flight = self.max_workers * 4
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                ThreadPoolExecutor(max_workers=self.large_workers) as large_executor:
+            in_flight = {}
+            for source, verify in copies:
+                if self.dry_run:
+                    logger.info(f"Would copy: {source.name}")
+                    continue
+                if source.size >= self.rewrite_threshold:
+                    future = large_executor.submit(self.copy_file, source, verify)
+                    future.add_done_callback(lambda future, source=source: record(future, source))
+                    continue
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(future, in_flight.pop(future))
+                in_flight[executor.submit(self.copy_file, source, verify)] = source
+
+            for future in list(in_flight):
+                record(future, in_flight.pop(future))
+
+    def plan_shard(self, shard: Tuple[str, bool], stats: dict, warm: bool) -> Iterator[Tuple[ObjectInfo, bool]]:
+        """Diff one listing shard against the manifest or the destination listing
+
+        Yields (source object, verify) for every object to copy. With a warm
+        manifest, objects whose source generation is unchanged are skipped
+        without touching the destination; objects unknown to the manifest are
+        verified against the destination before copying. Otherwise both
+        listings are streamed through a sorted merge-join and compared by size
+        and hash.
+        """
+        prefix, delimited = shard
+        source_objects = self.list_objects(self.source_bucket, prefix, delimited)
+
+        if warm:
+            for source in source_objects:
+                synced = self.manifest.get(source.name)
+                if synced is not None and synced.generation == source.generation:
+                    self.count(stats, 'total_files', 'existing_files')
+                    continue
+                self.count(stats, 'total_files', 'changed_files' if synced is not None else 'new_files')
+                yield source, synced is None
+            return
+
+        dest_objects = self.list_objects(self.dest_bucket, prefix, delimited)
+        for source, dest in merge_join(source_objects, dest_objects):
+            if dest is not None and same_content(source, dest):
+                self.count(stats, 'total_files', 'existing_files')
+                if not self.dry_run:
+                    self.manifest.record(source, dest.generation)
+                continue
+            self.count(stats, 'total_files', 'changed_files' if dest is not None else 'new_files')
+            yield source, False
+
+    def count(self, stats: dict, *keys: str) -> None:
+        """Increment stats counters shared by the listing and copy threads"""
+        with self._stats_lock:
+            for key in keys:
+                stats[key] += 1
+
+    def plan_copies(self, stats: dict, warm: bool, cancelled: threading.Event) -> Iterator[Tuple[ObjectInfo, bool]]:
+        """List and diff all shards in parallel, streaming planned copies as they are found
+
+        Shards feed a bounded queue, so copying starts while listing is still in
+        progress and memory stays bounded. A failed shard is logged and counted
+        in stats['failed_shards'].
+        """
+        copy_queue = queue.Queue(maxsize=COPY_QUEUE_SIZE)
+        done = object()
+
+        def put(item):
+            while not cancelled.is_set():
+                try:
+                    copy_queue.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+            raise RuntimeError("Sync cancelled")
+
+        def plan_shard(shard):
+            # Listing time excludes waits on the full queue
+            copies = self.plan_shard(shard, stats, warm)
+            while True:
+                with run_metrics.span(self.scope, 'list'):
+                    copy = next(copies, None)
+                if copy is None:
+                    return
+                put(copy)
+
+        def plan_all():
+            try:
+                shards = self.list_shards()
+                logger.info(f"Listing {len(shards)} shards with {self.list_workers} workers")
+                with ThreadPoolExecutor(max_workers=self.list_workers) as executor:
+                    futures = {executor.submit(plan_shard, shard): shard for shard in shards}
+                    for future, shard in futures.items():
+                        try:
+                            future.result()
+                        except Exception as e:
+                            self.count(stats, 'failed_shards')
+                            logger.error(f"Failed to list shard '{shard[0]}': {str(e)}")
+            except Exception as e:
+                self.count(stats, 'failed_shards')
+                logger.error(f"Failed to list shards: {str(e)}")
+            finally:
+                # Always wake the consumer, even when listing failed
+                try:
+                    put(done)
+                except RuntimeError:
+                    pass
+
+        planner = threading.Thread(target=plan_all, daemon=True)
+        planner.start()
+        try:
+            yield from iter(copy_queue.get, done)
+        finally:
+            cancelled.set()
+            planner.join()
 
     def sync_bucket(self) -> dict:
-        """Sync files from source to destination bucket based on file existence"""
+        """Sync new and modified files from source to destination bucket
+
+        Stage timings, the stats counters and the outcome are recorded in the
+        run metrics under the pair's scope.
+        """
+        start = time.perf_counter()
         stats = {
             'total_files': 0,
             'new_files': 0,
-            'existing_files': 0
+            'changed_files': 0,
+            'existing_files': 0,
+            'copied_files': 0,
+            'copied_bytes': 0,
+            'verified_files': 0,
+            'failed_files': 0,
+            'failed_shards': 0,
+            'retries': 0
         }
 
         try:
-            # Get lists of files in both buckets
-            source_files = self.get_existing_files(self.source_bucket)
-            dest_files = self.get_existing_files(self.dest_bucket)
+            warm = self.manifest.is_warm()
+            if warm:
+                logger.info("Manifest is warm, comparing source generations without listing the destination")
             
-            stats['total_files'] = len(source_files)
+            # Copy new and changed files concurrently while the buckets are listed
+            self.copy_files(self.plan_copies(stats, warm, threading.Event()), stats)
             logger.info(f"Found {stats['total_files']} files in source bucket")
             
-            # Find files that need to be copied
-            files_to_copy = source_files - dest_files
-            stats['new_files'] = len(files_to_copy)
-            stats['existing_files'] = len(source_files & dest_files)
-            
-            # Copy new files
-            for file_path in sorted(files_to_copy):
-                if not self.dry_run:
-                    source_blob = self.source_bucket.blob(file_path)
-                    self.source_bucket.copy_blob(
-                        source_blob,
-                        self.dest_bucket,
-                        file_path
-                    )
-                    action = "Copied"
+            if not self.dry_run:
+                if warm or stats['failed_shards']:
+                    self.manifest.flush()
                 else:
-                    action = "Would copy"
-                
-                logger.info(f"{action}: {file_path}")
+                    self.manifest.finish_verification()
 
             # Log summary
-            action_prefix = "Would copy" if self.dry_run else "Copied"
-            logger.info(
-                f"Sync completed - Total files: {stats['total_files']}, "
-                f"{action_prefix}: {stats['new_files']}, "
-                f"Already existed: {stats['existing_files']}"
-            )
+            if self.dry_run:
+                logger.info(
+                    f"Sync completed - Total files: {stats['total_files']}, "
+                    f"Would copy: {stats['new_files'] + stats['changed_files']} "
+                    f"({stats['new_files']} new, {stats['changed_files']} changed), "
+                    f"Unchanged: {stats['existing_files']}"
+                )
+            else:
+                logger.info(
+                    f"Sync completed - Total files: {stats['total_files']}, "
+                    f"Copied: {stats['copied_files']} "
+                    f"({stats['new_files']} new, {stats['changed_files']} changed, {stats['copied_bytes']} bytes), "
+                    f"Already identical: {stats['verified_files']}, "
+                    f"Failed: {stats['failed_files']}, "
+                    f"Retries: {stats['retries']}, "
+                    f"Unchanged: {stats['existing_files']}"
+                )
+            if stats['failed_files'] or stats['failed_shards']:
+                # Keep the counts but mark the pair as failed for the run report
+                stats['error'] = f"{stats['failed_files']} files failed to copy, {stats['failed_shards']} listing shards failed"
+            for key, value in stats.items():
+                if key != 'error':
+                    run_metrics.count(self.scope, key, value)
+            run_metrics.set_status(self.scope, 'error' not in stats, stats.get('error'))
             return stats
 
         except Exception as e:
             logger.error(f"Error during bucket sync: {str(e)}")
+            run_metrics.set_status(self.scope, False, str(e))
             raise
+        finally:
+            run_metrics.add_time(self.scope, 'total', time.perf_counter() - start)
+            run_metrics.observe_memory(self.scope)
+            self.manifest.close()
+
+def merge_join(source_objects: Iterable[ObjectInfo], dest_objects: Iterable[ObjectInfo]) -> Iterator[Tuple[ObjectInfo, Optional[ObjectInfo]]]:
+    """Pair each source object with the same-named destination object (or None)
 
-def sync_gcs_buckets(bucket_pairs: List[Tuple[str, str]], dry_run: bool = False) -> Dict[str, dict]:
+    Both inputs must be sorted by name, as GCS listings are, so only the
+    current object of each listing is held in memory.
     """
-    Sync files for multiple bucket pairs
+    dest_iter = iter(dest_objects)
+    dest = next(dest_iter, None)
+    for source in source_objects:
+        while dest is not None and dest.name < source.name:
+            dest = next(dest_iter, None)
+        yield source, dest if dest is not None and dest.name == source.name else None
+
+def sync_gcs_buckets(bucket_pairs: List[Tuple[str, str]], dry_run: bool = False,
+                     client: Optional[storage.Client] = None) -> Dict[str, dict]:
+    """
+    Sync files for multiple bucket pairs, several pairs at a time
     
     Args:
         bucket_pairs: List of tuples containing (source_bucket, dest_bucket) pairs
         dry_run: If True, only show what would be copied without actually copying
+        client: Optional storage client shared by all pairs (e.g. for an emulator)
     
     Returns:
         dict: Statistics about the sync operation for each bucket pair
     """
     all_stats = {}
+    client = client or storage.Client()
     
-    for source_bucket, dest_bucket in bucket_pairs:
+    def sync_pair(source_bucket, dest_bucket):
         pair_name = f"{source_bucket} → {dest_bucket}"
         logger.info(f"\nProcessing bucket pair: {pair_name}")
         
         try:
-            sync_handler = GCSBucketSync(source_bucket, dest_bucket, dry_run)
+            sync_handler = GCSBucketSync(source_bucket, dest_bucket, dry_run, client=client)
             all_stats[pair_name] = sync_handler.sync_bucket()
         except Exception as e:
             logger.error(f"Failed to sync bucket pair {pair_name}: {str(e)}")
             all_stats[pair_name] = {"error": str(e)}
     
+    max_pairs = int(os.getenv('GCS_MAX_CONCURRENT_PAIRS', DEFAULT_MAX_CONCURRENT_PAIRS))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_pairs, len(bucket_pairs)))) as executor:
+        for future in [executor.submit(sync_pair, *pair) for pair in bucket_pairs]:
+            future.result()
+    
     return all_stats
 
 if __name__ == "__main__":
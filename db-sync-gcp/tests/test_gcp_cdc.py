@@ -0,0 +1,162 @@
+"""pgoutput decoding and change collapsing, fed hand-built protocol v1 messages"""
+import struct
+
+from gcp_cdc import UNCHANGED_TOAST, decode_message, decode_transactions, group_change_runs
+
+USERS_RELID = 16384
+ORDERS_RELID = 16390
+
+def string(value):
+    return value.encode() + b'\0'
+
+def tuple_data(*values):
+    """TupleData: None is a NULL, UNCHANGED_TOAST an unchanged TOASTed value, anything else text"""
+    data = struct.pack('!h', len(values))
+    for value in values:
+        if value is None:
+            data += b'n'
+        elif value is UNCHANGED_TOAST:
+            data += b'u'
+        else:
+            encoded = str(value).encode()
+            data += b't' + struct.pack('!i', len(encoded)) + encoded
+    return data
+
+def begin(xid=700):
+    return b'B' + struct.pack('!qqI', 0x1000, 0, xid)
+
+def commit(end_lsn):
+    return b'C' + struct.pack('!bqqq', 0, end_lsn - 8, end_lsn, 0)
+
+def relation(relid, table_name, columns, key_columns):
+    data = b'R' + struct.pack('!I', relid) + string('public') + string(table_name) + struct.pack('!b', ord('d'))
+    data += struct.pack('!h', len(columns))
+    for column in columns:
+        data += struct.pack('!b', 1 if column in key_columns else 0) + string(column) + struct.pack('!Ii', 25, -1)
+    return data
+
+def insert(relid, *values):
+    return b'I' + struct.pack('!I', relid) + b'N' + tuple_data(*values)
+
+def update(relid, new_values, old_key=None):
+    data = b'U' + struct.pack('!I', relid)
+    if old_key is not None:
+        data += b'K' + tuple_data(*old_key)
+    return data + b'N' + tuple_data(*new_values)
+
+def delete(relid, *key_values):
+    return b'D' + struct.pack('!I', relid) + b'K' + tuple_data(*key_values)
+
+def truncate(*relids):
+    return b'T' + struct.pack('!ib', len(relids), 0) + b''.join(struct.pack('!I', relid) for relid in relids)
+
+def users_relation():
+    return relation(USERS_RELID, 'users', ['id', 'name', 'bio'], ['id'])
+
+TABLE_SPECS = {'users': {'columns': ['id', 'name', 'bio'], 'primary_keys': ['id']}}
+
+def test_decode_relation_registers_columns_and_key():
+    relations = {}
+    assert decode_message(users_relation(), relations) is None
+    assert relations[USERS_RELID] == {'table_name': 'users', 'columns': ['id', 'name', 'bio'], 'key_columns': ['id']}
+
+def test_decode_begin_and_commit():
+    assert decode_message(begin(), {}) == ('begin',)
+    assert decode_message(commit(0x2000), {}) == ('commit', 0x2000)
+
+def test_decode_insert_with_null():
+    relations = {}
+    decode_message(users_relation(), relations)
+    assert decode_message(insert(USERS_RELID, 1, 'ann', None), relations) == (
+        'upsert', USERS_RELID, {'id': '1', 'name': 'ann', 'bio': None}
+    )
+
+def test_decode_update_keeps_unchanged_toast_marker():
+    relations = {}
+    decode_message(users_relation(), relations)
+    event = decode_message(update(USERS_RELID, [1, 'anna', UNCHANGED_TOAST]), relations)
+    assert event == ('upsert', USERS_RELID, {'id': '1', 'name': 'anna', 'bio': UNCHANGED_TOAST})
+
+def test_decode_update_of_key_deletes_old_key():
+    relations = {}
+    decode_message(users_relation(), relations)
+    events = decode_message(update(USERS_RELID, [2, 'ann', 'x'], old_key=[1, None, None]), relations)
+    assert events == [
+        ('delete', USERS_RELID, {'id': '1'}),
+        ('upsert', USERS_RELID, {'id': '2', 'name': 'ann', 'bio': 'x'}),
+    ]
+
+def test_decode_delete_and_truncate():
+    relations = {}
+    decode_message(users_relation(), relations)
+    assert decode_message(delete(USERS_RELID, 3, None, None), relations) == ('delete', USERS_RELID, {'id': '3'})
+    assert decode_message(truncate(USERS_RELID, ORDERS_RELID), relations) == ('truncate', [USERS_RELID, ORDERS_RELID])
+
+def test_decode_transactions_groups_by_commit():
+    relations = {}
+    messages = [
+        begin(), users_relation(), insert(USERS_RELID, 1, 'ann', 'a'), commit(0x2000),
+        begin(), delete(USERS_RELID, 1, None, None), commit(0x3000),
+    ]
+    assert decode_transactions(messages, relations) == [
+        (0x2000, [('upsert', USERS_RELID, {'id': '1', 'name': 'ann', 'bio': 'a'})]),
+        (0x3000, [('delete', USERS_RELID, {'id': '1'})]),
+    ]
+
+def test_decode_transactions_drops_uncommitted_tail():
+    relations = {}
+    messages = [begin(), users_relation(), insert(USERS_RELID, 1, 'ann', 'a')]
+    assert decode_transactions(messages, relations) == []
+
+def test_group_change_runs_keeps_last_change_per_key():
+    relations = {}
+    messages = [
+        begin(), users_relation(),
+        insert(USERS_RELID, 1, 'ann', 'a'),
+        insert(USERS_RELID, 2, 'bob', 'b'),
+        update(USERS_RELID, [1, 'anna', 'a2']),
+        commit(0x2000),
+    ]
+    runs = group_change_runs(decode_transactions(messages, relations), relations, TABLE_SPECS)
+    assert runs == [('upsert', 'users', ('id', 'name', 'bio'), {
+        ('1',): {'id': '1', 'name': 'anna', 'bio': 'a2'},
+        ('2',): {'id': '2', 'name': 'bob', 'bio': 'b'},
+    })]
+
+def test_group_change_runs_splits_unchanged_toast_columns():
+    relations = {}
+    messages = [
+        begin(), users_relation(),
+        insert(USERS_RELID, 1, 'ann', 'a'),
+        update(USERS_RELID, [1, 'anna', UNCHANGED_TOAST]),
+        commit(0x2000),
+    ]
+    runs = group_change_runs(decode_transactions(messages, relations), relations, TABLE_SPECS)
+    # The unchanged TOAST column is left out, so the update must not overwrite bio
+    assert runs == [
+        ('upsert', 'users', ('id', 'name', 'bio'), {('1',): {'id': '1', 'name': 'ann', 'bio': 'a'}}),
+        ('upsert', 'users', ('id', 'name'), {('1',): {'id': '1', 'name': 'anna'}}),
+    ]
+
+def test_group_change_runs_keeps_operation_order():
+    relations = {}
+    messages = [
+        begin(), users_relation(),
+        insert(USERS_RELID, 1, 'ann', 'a'),
+        delete(USERS_RELID, 1, None, None),
+        truncate(USERS_RELID),
+        insert(USERS_RELID, 2, 'bob', 'b'),
+        commit(0x2000),
+    ]
+    runs = group_change_runs(decode_transactions(messages, relations), relations, TABLE_SPECS)
+    assert [run[0] for run in runs] == ['upsert', 'delete', 'truncate', 'upsert']
+    assert runs[1] == ('delete', 'users', ('id',), {('1',): {'id': '1'}})
+
+def test_group_change_runs_skips_unsynced_tables():
+    relations = {}
+    messages = [
+        begin(), users_relation(), relation(ORDERS_RELID, 'orders', ['id'], ['id']),
+        insert(ORDERS_RELID, 9), truncate(ORDERS_RELID),
+        commit(0x2000),
+    ]
+    assert group_change_runs(decode_transactions(messages, relations), relations, TABLE_SPECS) == []
@@ -0,0 +1,33 @@
+"""Spill eviction around spills that a load is still using"""
+import os
+
+import gcp_spill
+from gcp_spill import evict_spills, spill_in_use
+
+def write_file(path, size, mtime):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (mtime, mtime))
+
+def test_evict_skips_spills_in_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(gcp_spill, 'SPILL_DIR', str(tmp_path))
+    old = str(tmp_path / 'orders' / 'old.arrow')
+    current = str(tmp_path / 'users' / 'current.arrow')
+    write_file(old, 100, 1000)
+    write_file(current, 500, 500)
+
+    # The current spill alone exceeds the limit and is the oldest, yet survives
+    with spill_in_use(current):
+        evict_spills(max_bytes=200)
+    assert os.path.exists(current)
+    assert not os.path.exists(old)
+
+def test_evict_releases_spills_after_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(gcp_spill, 'SPILL_DIR', str(tmp_path))
+    path = str(tmp_path / 'users' / 'current.arrow')
+    write_file(path, 500, 500)
+    with spill_in_use(path):
+        pass
+    evict_spills(max_bytes=200)
+    assert not os.path.exists(path)
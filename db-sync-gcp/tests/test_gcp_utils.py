@@ -0,0 +1,32 @@
+"""Multi-row VALUES inserts through pg8000's format paramstyle"""
+import gcp_utils
+from gcp_utils import execute_values
+
+class RecordingCursor:
+    """Cursor stand-in returning one RETURNING row per inserted record"""
+
+    def __init__(self):
+        self.statements = []
+        self.last_rows = 0
+
+    def execute(self, query, params):
+        self.statements.append((query, params))
+        self.last_rows = query.count('(%s,%s)')
+
+    def fetchall(self):
+        return [(True,)] * self.last_rows
+
+def test_one_statement_per_batch():
+    cursor = RecordingCursor()
+    written = execute_values(cursor, "INSERT INTO t (a, b) VALUES %s RETURNING (xmax = 0)", [(1, 'x'), (2, None)])
+    assert cursor.statements == [
+        ("INSERT INTO t (a, b) VALUES (%s,%s),(%s,%s) RETURNING (xmax = 0)", (1, 'x', 2, None)),
+    ]
+    assert written == [(True,), (True,)]
+
+def test_pages_stay_under_the_parameter_limit(monkeypatch):
+    monkeypatch.setattr(gcp_utils, 'MAX_STATEMENT_PARAMS', 4)
+    cursor = RecordingCursor()
+    written = execute_values(cursor, "INSERT INTO t (a, b) VALUES %s", [(i, i) for i in range(5)])
+    assert [len(params) for _, params in cursor.statements] == [4, 4, 2]
+    assert len(written) == 5
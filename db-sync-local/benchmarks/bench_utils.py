@@ -0,0 +1,60 @@
+"""Shared helpers for the benchmark scripts: memory, result tables and regression baselines"""
+import json
+import resource
+import sys
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def print_results(results, columns):
+    """Print one row per scenario with the given metric columns"""
+    header = f"{'scenario':<32}" + ''.join(f"{column:>16}" for column in columns)
+    print(header)
+    print('-' * len(header))
+    for name, metrics in results.items():
+        cells = []
+        for column in columns:
+            value = metrics.get(column)
+            cells.append(f"{value:>16,.1f}" if isinstance(value, (int, float)) else f"{'-':>16}")
+        print(f"{name:<32}" + ''.join(cells))
+
+def write_baseline(results, path, tolerance):
+    """Write regression thresholds derived from these results
+
+    Throughput metrics (*_per_sec) may drop by `tolerance` and peak RSS may
+    grow by it before a later run counts as a regression.
+    """
+    baseline = {}
+    for name, metrics in results.items():
+        thresholds = {}
+        for metric, value in metrics.items():
+            if metric.endswith('_per_sec'):
+                thresholds[f"min_{metric}"] = round(value * (1 - tolerance), 1)
+            elif metric == 'peak_rss_mb':
+                thresholds['max_peak_rss_mb'] = round(value * (1 + tolerance), 1)
+        baseline[name] = thresholds
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    print(f"Wrote baseline thresholds for {len(baseline)} scenarios to {path}")
+
+def check_baseline(results, path):
+    """Compare results with a baseline file; returns the list of regressions"""
+    with open(path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for name, thresholds in baseline.items():
+        metrics = results.get(name)
+        if metrics is None:
+            continue
+        for threshold, limit in thresholds.items():
+            kind, metric = threshold.split('_', 1)
+            value = metrics.get(metric)
+            if value is None:
+                continue
+            if (kind == 'min' and value < limit) or (kind == 'max' and value > limit):
+                regressions.append(f"{name}: {metric} {value:,.1f} (threshold {kind} {limit:,.1f})")
+    return regressions
@@ -0,0 +1,130 @@
+"""GCS bucket sync benchmark against a local emulator (fake-gcs-server)
+
+Uploads synthetic objects to a source bucket, then times a cold sync (empty
+destination, no manifest), a warm no-op sync and a sync after a share of the
+objects changed. Reports objects/sec, MB/sec and peak RSS per scenario.
+
+Usage:
+    docker compose --profile benchmark up -d gcs-emulator
+    python benchmarks/gcs_benchmark.py --objects 10000 --size-kb 64
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'db-sync-gcp'))
+
+from bench_utils import peak_rss_mb, print_results, write_baseline, check_baseline  # noqa: E402
+
+SOURCE_BUCKET = 'bench-source'
+DEST_BUCKET = 'bench-dest'
+
+# Threads uploading the synthetic objects
+UPLOAD_WORKERS = 16
+
+def emulator_client():
+    """Storage client pointed at STORAGE_EMULATOR_HOST without credentials"""
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import storage
+
+    endpoint = os.environ.setdefault('STORAGE_EMULATOR_HOST', 'http://localhost:4443')
+    return storage.Client(
+        project='benchmark', credentials=AnonymousCredentials(), client_options={'api_endpoint': endpoint}
+    )
+
+def reset_bucket(client, bucket_name):
+    """Create a bucket, or empty it if it already exists"""
+    bucket = client.bucket(bucket_name)
+    if bucket.exists():
+        for blob in client.list_blobs(bucket_name):
+            blob.delete()
+    else:
+        client.create_bucket(bucket_name)
+    return bucket
+
+def object_name(index, prefixes):
+    """Spread objects over prefixes so listing shards have work to split"""
+    return f"part-{index % prefixes:03d}/object-{index:08d}.bin"
+
+def upload_objects(bucket, indexes, size_bytes, prefixes, version=0):
+    """Upload objects with contents unique per index and version"""
+    def upload(index):
+        payload = f"{index}:{version}:".encode().ljust(size_bytes, b'x')
+        bucket.blob(object_name(index, prefixes)).upload_from_string(payload)
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        list(executor.map(upload, indexes))
+
+def timed_sync(client, size_bytes):
+    """Run one sync of the benchmark pair; returns its metrics"""
+    from gcs_sync import sync_gcs_buckets
+
+    start = time.perf_counter()
+    stats = next(iter(sync_gcs_buckets([(SOURCE_BUCKET, DEST_BUCKET)], client=client).values()))
+    seconds = time.perf_counter() - start
+    if 'error' in stats:
+        raise RuntimeError(f"Benchmark sync failed: {stats['error']}")
+
+    copied_mb = stats.get('copied_bytes', stats['copied_files'] * size_bytes) / (1024 * 1024)
+    return {
+        'objects': stats['total_files'],
+        'copied_files': stats['copied_files'],
+        'seconds': seconds,
+        'objects_per_sec': stats['total_files'] / seconds if seconds else 0.0,
+        'mb_per_sec': copied_mb / seconds if seconds else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--objects', type=int, default=10000)
+    parser.add_argument('--size-kb', type=int, default=64)
+    parser.add_argument('--prefixes', type=int, default=64, help="top-level prefixes the objects are spread over")
+    parser.add_argument('--changed-fraction', type=float, default=0.01, help="share of objects rewritten before the last run")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="fail when results regress past this baseline's thresholds")
+    parser.add_argument('--write-baseline', help="write thresholds derived from this run")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed regression when writing a baseline")
+    args = parser.parse_args()
+
+    # A fresh manifest directory makes the first run cold
+    os.environ['GCS_MANIFEST_DIR'] = tempfile.mkdtemp(prefix='gcs_benchmark_')
+    size_bytes = args.size_kb * 1024
+    client = emulator_client()
+
+    source = reset_bucket(client, SOURCE_BUCKET)
+    reset_bucket(client, DEST_BUCKET)
+    start = time.perf_counter()
+    upload_objects(source, range(args.objects), size_bytes, args.prefixes)
+    print(f"Uploaded {args.objects:,} objects of {args.size_kb} KB in {time.perf_counter() - start:.1f}s")
+
+    label = f"{args.objects}x{args.size_kb}kb"
+    results = {f"gcs/cold/{label}": timed_sync(client, size_bytes)}
+    results[f"gcs/warm/{label}"] = timed_sync(client, size_bytes)
+
+    changed = max(1, int(args.objects * args.changed_fraction))
+    upload_objects(source, range(0, args.objects, max(1, args.objects // changed)), size_bytes, args.prefixes, version=1)
+    results[f"gcs/changed/{label}"] = timed_sync(client, size_bytes)
+
+    print()
+    print_results(results, ['objects', 'copied_files', 'seconds', 'objects_per_sec', 'mb_per_sec', 'peak_rss_mb'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.write_baseline:
+        write_baseline(results, args.write_baseline, args.tolerance)
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
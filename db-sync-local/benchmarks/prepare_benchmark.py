@@ -0,0 +1,109 @@
+"""Micro-benchmark: row-wise prepare_record vs schema-compiled column converters
+
+Uses the netflix_shows rows from data/netflix.sql, replicated to the requested
+row count, shaped like the object-dtype chunks produced by extraction.
+
+Usage: python benchmarks/prepare_benchmark.py [rows]
+"""
+import datetime
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sync_utils import compile_column_converters, prepare_chunk  # noqa: E402
+
+DUMP_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'netflix.sql')
+
+# Column list as get_table_schema returns it for netflix_shows (format_type() names)
+NETFLIX_COLUMNS = [
+    {'name': 'show_id', 'type': 'text', 'nullable': False},
+    {'name': 'type', 'type': 'text', 'nullable': True},
+    {'name': 'title', 'type': 'text', 'nullable': True},
+    {'name': 'director', 'type': 'text', 'nullable': True},
+    {'name': 'cast_members', 'type': 'text', 'nullable': True},
+    {'name': 'country', 'type': 'text', 'nullable': True},
+    {'name': 'date_added', 'type': 'date', 'nullable': True},
+    {'name': 'release_year', 'type': 'integer', 'nullable': True},
+    {'name': 'rating', 'type': 'text', 'nullable': True},
+    {'name': 'duration', 'type': 'text', 'nullable': True},
+    {'name': 'listed_in', 'type': 'text', 'nullable': True},
+    {'name': 'description', 'type': 'text', 'nullable': True},
+]
+
+def load_dump_rows():
+    """Parse the COPY block of the netflix dump into typed driver-like tuples"""
+    rows = []
+    in_copy = False
+    with open(DUMP_PATH, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('COPY public.netflix_shows'):
+                in_copy = True
+                continue
+            if not in_copy:
+                continue
+            if line.startswith('\\.'):
+                break
+            values = [None if v == '\\N' else v for v in line.rstrip('\n').split('\t')]
+            if values[6] is not None:
+                values[6] = datetime.date.fromisoformat(values[6])
+            if values[7] is not None:
+                values[7] = int(values[7])
+            rows.append(tuple(values))
+    return rows
+
+def legacy_prepare_record(row, columns):
+    """The per-row prepare_record this benchmark compares against"""
+    values = []
+    for col in columns:
+        value = row[col['name']]
+        if col['type'].startswith('ARRAY') or col['type'].endswith('[]'):
+            if value is None or (isinstance(value, list) and len(value) == 0):
+                values.append([])
+            elif isinstance(value, list):
+                values.append(value)
+            else:
+                values.append([])
+        elif pd.isnull(value):
+            values.append(None)
+        elif col['type'].startswith('jsonb'):
+            values.append(value if isinstance(value, str) else json.dumps(value))
+        elif 'int' in col['type'] or col['type'] == 'bigserial':
+            values.append(int(float(value)) if pd.notnull(value) else None)
+        else:
+            values.append(str(value).strip() if pd.notnull(value) else None)
+    return tuple(values)
+
+def build_chunk(rows, total_rows):
+    """Replicate dump rows into an object-dtype DataFrame of total_rows rows"""
+    repeated = (rows * (total_rows // len(rows) + 1))[:total_rows]
+    names = [col['name'] for col in NETFLIX_COLUMNS]
+    return pd.DataFrame(repeated, columns=names, dtype=object)
+
+def main():
+    total_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    chunk = build_chunk(load_dump_rows(), total_rows)
+
+    start = time.perf_counter()
+    legacy = [legacy_prepare_record(row, NETFLIX_COLUMNS) for _, row in chunk.iterrows()]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    converters = compile_column_converters(NETFLIX_COLUMNS)
+    compiled = prepare_chunk(chunk, NETFLIX_COLUMNS, converters)
+    compiled_seconds = time.perf_counter() - start
+
+    if legacy != compiled:
+        print("WARNING: compiled output differs from prepare_record output")
+
+    print(f"rows: {total_rows}")
+    print(f"prepare_record (row-wise):  {total_rows / legacy_seconds:>12,.0f} rows/sec")
+    print(f"compiled converters:        {total_rows / compiled_seconds:>12,.0f} rows/sec")
+    print(f"speedup:                    {legacy_seconds / compiled_seconds:>12.1f}x")
+
+if __name__ == "__main__":
+    main()
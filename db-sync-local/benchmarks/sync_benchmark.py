@@ -0,0 +1,338 @@
+"""End-to-end sync benchmark against the docker-compose prod/stage Postgres pair
+
+Builds scaled synthetic tables on prod (netflix_shows rows from data/netflix.sql
+and a jsonb/array-heavy table shaped like the inventory tables), then runs
+sync_table in initial-load and incremental modes. Reports rows/sec, MB/sec,
+peak RSS and the time the sync's run metrics record for each stage.
+
+Every scenario pins passthrough (off unless --sync-option passthrough=true),
+so a change of the default never changes what a baseline measured.
+
+Each measured sync runs in a fresh process so peak RSS belongs to that sync.
+
+Usage:
+    docker compose up -d
+    python benchmarks/sync_benchmark.py --rows 1000000 --dataset netflix inventory
+    python benchmarks/sync_benchmark.py --rows 1000000 --write-baseline benchmarks/baseline.json
+    python benchmarks/sync_benchmark.py --rows 1000000 --baseline benchmarks/baseline.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import tempfile
+import time
+import traceback
+
+import yaml
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_utils import peak_rss_mb, print_results, write_baseline, check_baseline  # noqa: E402
+from prepare_benchmark import load_dump_rows  # noqa: E402
+
+# Rows generated per COPY payload while building the synthetic tables
+GENERATE_BATCH_ROWS = 50000
+
+# Seconds between checks that a measured sync's process is still running
+RESULT_POLL_SECONDS = 5
+
+DATASETS = {
+    'netflix': {
+        'table_name': 'bench_netflix_shows',
+        'ddl': """
+            CREATE TABLE {table_name} (
+                show_id text PRIMARY KEY,
+                type text,
+                title text,
+                director text,
+                cast_members text,
+                country text,
+                date_added date,
+                release_year integer,
+                rating text,
+                duration text,
+                listed_in text,
+                description text
+            )
+        """,
+        'sync_config': {'check_column': 'date_added', 'check_type': 'timestamp', 'passthrough': False},
+    },
+    'inventory': {
+        'table_name': 'bench_inventory_levels',
+        'ddl': """
+            CREATE TABLE {table_name} (
+                id bigint PRIMARY KEY,
+                variant_id bigint NOT NULL,
+                location_id integer NOT NULL,
+                sku text,
+                quantities integer[],
+                tags text[],
+                metadata jsonb,
+                updated timestamp NOT NULL
+            )
+        """,
+        'sync_config': {'check_column': 'id', 'check_type': 'id', 'passthrough': False},
+    },
+}
+
+def copy_field(value):
+    """Render a value as a COPY text-format field"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def netflix_rows(start, count, dump_rows, date_offset_days=0):
+    """Replicate dump rows with unique keys; date_offset_days shifts date_added for incremental batches"""
+    for i in range(start, start + count):
+        row = list(dump_rows[i % len(dump_rows)])
+        row[0] = f"{row[0]}_{i}"
+        if row[6] is not None and date_offset_days:
+            row[6] = row[6] + datetime.timedelta(days=date_offset_days)
+        yield row
+
+def inventory_rows(start, count):
+    """Synthetic inventory levels with integer arrays, text arrays and nested jsonb"""
+    rng = random.Random(start)
+    base_time = datetime.datetime(2024, 1, 1)
+    for i in range(start, start + count):
+        quantities = [rng.randint(0, 500) for _ in range(rng.randint(1, 8))]
+        tags = [f"tag-{rng.randint(0, 99)}" for _ in range(rng.randint(0, 5))]
+        metadata = {
+            'warehouse': f"WH-{rng.randint(1, 40)}",
+            'dimensions': {'w': rng.randint(1, 100), 'h': rng.randint(1, 100), 'd': rng.randint(1, 100)},
+            'history': [{'qty': rng.randint(0, 500), 'reason': 'restock'} for _ in range(rng.randint(0, 4))],
+        }
+        yield [
+            i,
+            rng.randint(1, 10_000_000),
+            rng.randint(1, 500),
+            f"SKU-{i:010d}",
+            '{' + ','.join(map(str, quantities)) + '}',
+            '{' + ','.join(f'"{tag}"' for tag in tags) + '}',
+            json.dumps(metadata),
+            base_time + datetime.timedelta(seconds=i),
+        ]
+
+def copy_rows(engine, table_name, rows):
+    """Stream generated rows into a table with COPY, in batches"""
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        batch = []
+        for row in rows:
+            batch.append('\t'.join(copy_field(value) for value in row) + '\n')
+            if len(batch) >= GENERATE_BATCH_ROWS:
+                cursor.copy_expert(f"COPY {table_name} FROM STDIN", _TextStream(batch))
+                batch = []
+        if batch:
+            cursor.copy_expert(f"COPY {table_name} FROM STDIN", _TextStream(batch))
+        connection.commit()
+    finally:
+        connection.close()
+
+class _TextStream:
+    """Minimal file-like reader over a list of COPY lines"""
+
+    def __init__(self, lines):
+        self.data = ''.join(lines)
+        self.offset = 0
+
+    def read(self, size=-1):
+        end = len(self.data) if size is None or size < 0 else self.offset + size
+        chunk = self.data[self.offset:end]
+        self.offset += len(chunk)
+        return chunk
+
+    def readline(self, size=-1):
+        end = self.data.find('\n', self.offset) + 1 or len(self.data)
+        return self.read(end - self.offset)
+
+def generate_rows(dataset, start, count, dump_rows, incremental=False):
+    """Rows for a dataset; incremental batches sort after everything already loaded"""
+    if dataset == 'netflix':
+        return netflix_rows(start, count, dump_rows, date_offset_days=3650 if incremental else 0)
+    return inventory_rows(start, count)
+
+def setup_dataset(dataset, rows, prod_engine, stage_engine, dump_rows):
+    """Recreate the dataset's table on both sides and fill prod with `rows` rows"""
+    spec = DATASETS[dataset]
+    table_name = spec['table_name']
+    for engine in (prod_engine, stage_engine):
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f"DROP TABLE IF EXISTS {table_name}")
+            connection.exec_driver_sql(spec['ddl'].format(table_name=table_name))
+
+    start = time.perf_counter()
+    copy_rows(prod_engine, table_name, generate_rows(dataset, 0, rows, dump_rows))
+    with prod_engine.begin() as connection:
+        connection.exec_driver_sql(f"ANALYZE {table_name}")
+    print(f"Generated {rows:,} {dataset} rows in {time.perf_counter() - start:.1f}s")
+
+def reset_stage(stage_engine, table_name):
+    """Empty the staging table and forget its watermark so the next sync is an initial load"""
+    with stage_engine.begin() as connection:
+        connection.exec_driver_sql(f"TRUNCATE {table_name}")
+        exists = connection.exec_driver_sql("SELECT to_regclass('sync_watermarks')").scalar()
+        if exists:
+            connection.exec_driver_sql(
+                "DELETE FROM sync_watermarks WHERE table_name = %(table_name)s", {'table_name': table_name}
+            )
+
+def table_stats(engine, table_name):
+    """Row count and average on-disk bytes per row of a table"""
+    with engine.connect() as connection:
+        count, size = connection.exec_driver_sql(
+            f"SELECT count(*), pg_table_size('{table_name}') FROM {table_name}"
+        ).one()
+    return count, (size / count if count else 0)
+
+def measure_sync(table_name, result_queue):
+    """Run one sync_table in this (fresh) process and report wall time, stage times and peak RSS
+
+    Stage times are the sync's own run_metrics spans (extract, prepare, load,
+    merge, passthrough, pipeline_wait, ...). Concurrent spans of a stage are
+    summed, so with pipelining or partitions they can add up past wall time.
+    A failure is reported as {'error': traceback} so the parent never waits
+    for a result that will not come.
+    """
+    try:
+        from metrics import run_metrics
+        from sync_utils import sync_table
+
+        run_metrics.reset()
+        start = time.perf_counter()
+        sync_table(table_name)
+        seconds = time.perf_counter() - start
+
+        stages = run_metrics.report()['scopes'].get(table_name, {}).get('stages', {})
+        timings = {stage: entry['seconds'] for stage, entry in stages.items() if stage != 'total'}
+        result_queue.put({'seconds': seconds, 'stages': timings, 'peak_rss_mb': peak_rss_mb()})
+    except Exception:
+        result_queue.put({'error': traceback.format_exc()})
+        raise
+
+def run_measured(table_name):
+    """Run measure_sync in a spawned process so its peak RSS is isolated"""
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=measure_sync, args=(table_name, result_queue))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = result_queue.get(timeout=RESULT_POLL_SECONDS)
+        except queue.Empty:
+            # Killed without reporting (e.g. by the OOM killer); a last result may still be in flight
+            if not process.is_alive():
+                try:
+                    result = result_queue.get(timeout=RESULT_POLL_SECONDS)
+                except queue.Empty:
+                    raise RuntimeError(
+                        f"Benchmark process of {table_name} exited with code {process.exitcode} without a result"
+                    ) from None
+    process.join()
+    if 'error' in result:
+        raise RuntimeError(f"Sync of {table_name} failed in the benchmark process:\n{result['error']}")
+    return result
+
+def benchmark_dataset(dataset, args, prod_engine, stage_engine, dump_rows):
+    """Run the requested modes for one dataset; returns {scenario: metrics}"""
+    table_name = DATASETS[dataset]['table_name']
+    results = {}
+    if not args.skip_setup:
+        setup_dataset(dataset, args.rows, prod_engine, stage_engine, dump_rows)
+    prod_rows, row_bytes = table_stats(prod_engine, table_name)
+
+    for mode in args.mode:
+        if mode == 'initial':
+            reset_stage(stage_engine, table_name)
+        else:
+            # Append a slice of new rows to prod that sorts after the current watermark
+            increment = max(1, int(prod_rows * args.incremental_fraction))
+            copy_rows(prod_engine, table_name, generate_rows(dataset, prod_rows, increment, dump_rows, incremental=True))
+            prod_rows += increment
+
+        before, _ = table_stats(stage_engine, table_name)
+        result = run_measured(table_name)
+        after, _ = table_stats(stage_engine, table_name)
+
+        synced = after - before
+        seconds = result['seconds']
+        results[f"{dataset}/{mode}/{args.rows}"] = {
+            'rows': synced,
+            'seconds': seconds,
+            'rows_per_sec': synced / seconds if seconds else 0.0,
+            'mb_per_sec': synced * row_bytes / (1024 * 1024) / seconds if seconds else 0.0,
+            'peak_rss_mb': result['peak_rss_mb'],
+            **{f"{stage}_seconds": value for stage, value in result['stages'].items()},
+        }
+    return results
+
+def write_sync_config(args, path):
+    """Write the table YAML the benchmark syncs with (CONFIG_PATH)"""
+    tables = {}
+    for spec in DATASETS.values():
+        sync_config = dict(spec['sync_config'])
+        for option in args.sync_option:
+            key, value = option.split('=', 1)
+            sync_config[key] = yaml.safe_load(value)
+        tables[spec['table_name']] = {'sync_config': sync_config}
+    with open(path, 'w') as f:
+        yaml.safe_dump({'tables': tables}, f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000, help="rows generated per dataset (e.g. 1000000, 10000000)")
+    parser.add_argument('--dataset', nargs='+', choices=sorted(DATASETS), default=sorted(DATASETS))
+    parser.add_argument('--mode', nargs='+', choices=['initial', 'incremental'], default=['initial', 'incremental'])
+    parser.add_argument('--incremental-fraction', type=float, default=0.01, help="share of new rows per incremental run")
+    parser.add_argument('--sync-option', action='append', default=[], metavar='KEY=VALUE',
+                        help="extra sync_config entry, e.g. load_mode=insert or partitions=4")
+    parser.add_argument('--skip-setup', action='store_true', help="reuse the tables generated by a previous run")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="fail when results regress past this baseline's thresholds")
+    parser.add_argument('--write-baseline', help="write thresholds derived from this run")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed regression when writing a baseline")
+    args = parser.parse_args()
+
+    # The sync modules read their configuration from the environment on import
+    work_dir = tempfile.mkdtemp(prefix='sync_benchmark_')
+    os.environ['CONFIG_PATH'] = os.path.join(work_dir, 'tables.yaml')
+    os.environ['SYNC_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+    write_sync_config(args, os.environ['CONFIG_PATH'])
+
+    from utils import DB_CONFIGS
+    prod_engine = create_engine(DB_CONFIGS[os.getenv('DB_PROD_NAME')]['connection_string'])
+    stage_engine = create_engine(DB_CONFIGS[os.getenv('DB_STAGE_NAME')]['connection_string'])
+
+    dump_rows = load_dump_rows()
+    results = {}
+    for dataset in args.dataset:
+        results.update(benchmark_dataset(dataset, args, prod_engine, stage_engine, dump_rows))
+
+    print()
+    print_results(results, ['rows', 'seconds', 'rows_per_sec', 'mb_per_sec', 'peak_rss_mb',
+                            'extract_seconds', 'prepare_seconds', 'load_seconds', 'merge_seconds',
+                            'passthrough_seconds'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.write_baseline:
+        write_baseline(results, args.write_baseline, args.tolerance)
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
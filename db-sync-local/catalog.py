@@ -0,0 +1,117 @@
+from utils import logger
+import json
+import os
+
+# Directory holding the on-disk catalog cache, one file per database
+CATALOG_CACHE_DIR = os.getenv('SYNC_CACHE_DIR', '.sync_cache')
+
+# Cheap catalog-wide hash over relation OIDs, pg_attribute and key constraints;
+# it changes on any DDL affecting the tables' columns, types or keys
+FINGERPRINT_QUERY = """
+SELECT md5(string_agg(
+           c.oid::text || ':' || a.attnum || ':' || a.attname || ':' || a.atttypid::text
+           || ':' || a.atttypmod || ':' || a.attnotnull,
+           ',' ORDER BY c.oid, a.attnum))
+       || md5(COALESCE((
+           SELECT string_agg(con.oid::text || ':' || con.contype || ':' || con.conkey::text
+                             || ':' || con.confrelid::text, ',' ORDER BY con.oid)
+           FROM   pg_constraint con
+           JOIN   pg_class cc ON cc.oid = con.conrelid
+           WHERE  cc.relname = ANY(%(table_names)s)
+           AND    pg_table_is_visible(cc.oid)
+           AND    con.contype IN ('p', 'f')), '')) AS fingerprint
+FROM   pg_class c
+JOIN   pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+WHERE  c.relname = ANY(%(table_names)s)
+AND    c.relkind IN ('r', 'p')
+AND    pg_table_is_visible(c.oid);
+"""
+
+# Columns, primary keys and foreign keys of every requested table in one round trip
+CATALOG_QUERY = """
+SELECT c.relname AS table_name,
+       (SELECT json_agg(json_build_object(
+                   'name', a.attname,
+                   'type', format_type(a.atttypid, a.atttypmod),
+                   'nullable', NOT a.attnotnull) ORDER BY a.attnum)
+        FROM   pg_attribute a
+        WHERE  a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped) AS columns,
+       (SELECT json_agg(a.attname ORDER BY array_position(con.conkey, a.attnum))
+        FROM   pg_constraint con
+        JOIN   pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = ANY(con.conkey)
+        WHERE  con.conrelid = c.oid AND con.contype = 'p') AS primary_keys,
+       (SELECT json_agg(json_build_object(
+                   'parent_table', parent.relname,
+                   'columns', (SELECT json_agg(a.attname ORDER BY array_position(con.conkey, a.attnum))
+                               FROM   pg_attribute a
+                               WHERE  a.attrelid = con.conrelid AND a.attnum = ANY(con.conkey)),
+                   'parent_columns', (SELECT json_agg(a.attname ORDER BY array_position(con.confkey, a.attnum))
+                                      FROM   pg_attribute a
+                                      WHERE  a.attrelid = con.confrelid AND a.attnum = ANY(con.confkey))))
+        FROM   pg_constraint con
+        JOIN   pg_class parent ON parent.oid = con.confrelid
+        WHERE  con.conrelid = c.oid AND con.contype = 'f') AS foreign_keys
+FROM   pg_class c
+WHERE  c.relname = ANY(%(table_names)s)
+AND    c.relkind IN ('r', 'p')
+AND    pg_table_is_visible(c.oid);
+"""
+
+def get_schema_fingerprint(engine, table_names):
+    """Get a hash of the catalog entries describing the given tables"""
+    with engine.connect() as connection:
+        result = connection.exec_driver_sql(FINGERPRINT_QUERY, {'table_names': list(table_names)})
+        return result.scalar()
+
+def fetch_catalog(engine, table_names):
+    """Fetch columns, primary keys and foreign keys for the given tables"""
+    with engine.connect() as connection:
+        result = connection.exec_driver_sql(CATALOG_QUERY, {'table_names': list(table_names)})
+        catalog = {}
+        for row in result.mappings():
+            catalog[row['table_name']] = {
+                'columns': row['columns'] or [],
+                'primary_keys': row['primary_keys'] or [],
+                'foreign_keys': row['foreign_keys'] or [],
+            }
+        return catalog
+
+def load_catalog(engine, cache_key, table_names):
+    """Load the catalog for the given tables, reusing the on-disk cache while the schema is unchanged
+
+    cache_key identifies the database (e.g. 'prod_db'). The cache is
+    only refetched when the schema fingerprint differs from the cached one.
+    """
+    table_names = sorted(table_names)
+    cache_path = os.path.join(CATALOG_CACHE_DIR, f"catalog_{cache_key}.json")
+
+    try:
+        fingerprint = get_schema_fingerprint(engine, table_names)
+
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            if cached.get('fingerprint') == fingerprint and cached.get('table_names') == table_names:
+                logger.debug(f"Using cached catalog for {cache_key}")
+                return cached['tables']
+
+        logger.info(f"Fetching catalog for {len(table_names)} tables in {cache_key}")
+        catalog = fetch_catalog(engine, table_names)
+
+        # Write through a temp file so a crashed write never leaves a corrupt cache
+        os.makedirs(CATALOG_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'table_names': table_names, 'tables': catalog}, f)
+        os.replace(tmp_path, cache_path)
+
+        return catalog
+    except Exception as e:
+        logger.error(f"Error loading catalog for {cache_key}: {str(e)}")
+        raise
+
+def get_table_catalog(catalog, table_name):
+    """Get one table's catalog entry, failing clearly if the table does not exist"""
+    if table_name not in catalog:
+        raise ValueError(f"Table {table_name} not found in database catalog")
+    return catalog[table_name]
@@ -0,0 +1,331 @@
+from utils import logger, run_in_transaction, DEFAULT_BATCH_RETRIES
+from sync_utils import sync_table, generate_upsert_query, get_primary_keys, get_table_schema
+from catalog import get_table_catalog
+from psycopg2.extras import execute_values
+import os
+import struct
+
+# Changes decoded per round trip (SYNC_CDC_BATCH_CHANGES); decoding always stops
+# on a transaction boundary, so a round may return more rows than this
+DEFAULT_CDC_BATCH_CHANGES = 10000
+
+# Marker for TOASTed values an UPDATE left unchanged (not sent by pgoutput)
+UNCHANGED_TOAST = object()
+
+PEEK_CHANGES_QUERY = """
+SELECT data
+FROM   pg_logical_slot_peek_binary_changes(
+           %(slot_name)s::name, NULL, %(batch_changes)s::int,
+           'proto_version', '1', 'publication_names', %(publication)s::text)
+"""
+
+# Replication slot and publication created on the prod database
+CDC_SLOT_NAME = os.getenv('SYNC_CDC_SLOT', 'db_sync')
+
+def format_lsn(lsn):
+    """Render a 64-bit WAL position as a pg_lsn literal"""
+    return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
+
+def ensure_replication_slot(engine, slot_name):
+    """Create the pgoutput logical replication slot if missing; returns True when it was created"""
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM pg_replication_slots WHERE slot_name = %(slot_name)s", {'slot_name': slot_name}
+        ).first()
+        if exists:
+            return False
+        connection.exec_driver_sql("SELECT pg_create_logical_replication_slot(%(slot_name)s::name, 'pgoutput')", {'slot_name': slot_name})
+    logger.info(f"Created logical replication slot {slot_name}")
+    return True
+
+def ensure_publication(engine, publication, table_names):
+    """Make the publication cover exactly table_names; returns the tables that were added"""
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM pg_publication WHERE pubname = %(publication)s", {'publication': publication}
+        ).first()
+        if not exists:
+            connection.exec_driver_sql(f"CREATE PUBLICATION {publication} FOR TABLE {', '.join(table_names)}")
+            logger.info(f"Created publication {publication} for {', '.join(table_names)}")
+            return list(table_names)
+
+        published = {row[0] for row in connection.exec_driver_sql(
+            "SELECT tablename FROM pg_publication_tables WHERE pubname = %(publication)s", {'publication': publication}
+        )}
+        added = [table_name for table_name in table_names if table_name not in published]
+        removed = sorted(published - set(table_names))
+        if added:
+            connection.exec_driver_sql(f"ALTER PUBLICATION {publication} ADD TABLE {', '.join(added)}")
+            logger.info(f"Added {', '.join(added)} to publication {publication}")
+        if removed:
+            connection.exec_driver_sql(f"ALTER PUBLICATION {publication} DROP TABLE {', '.join(removed)}")
+            logger.info(f"Removed {', '.join(removed)} from publication {publication}")
+        return added
+
+def drop_from_publication(engine, publication, table_name):
+    """Remove a table from the publication so the next run starts it with a fresh initial copy"""
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"ALTER PUBLICATION {publication} DROP TABLE {table_name}")
+
+class MessageReader:
+    """Sequential reader over one pgoutput protocol message"""
+
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.offset = 0
+
+    def read(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values[0] if len(values) == 1 else values
+
+    def read_string(self):
+        end = self.data.index(b'\0', self.offset)
+        value = self.data[self.offset:end].decode('utf-8')
+        self.offset = end + 1
+        return value
+
+    def read_tuple(self):
+        values = []
+        for _ in range(self.read('!h')):
+            kind = self.read('!c')
+            if kind == b'n':
+                values.append(None)
+            elif kind == b'u':
+                values.append(UNCHANGED_TOAST)
+            else:
+                length = self.read('!i')
+                values.append(self.data[self.offset:self.offset + length].decode('utf-8'))
+                self.offset += length
+        return values
+
+def decode_message(data, relations):
+    """Decode one pgoutput v1 message into a change event
+
+    Relation messages update `relations` (relid -> table description) and
+    return None, as do messages that carry no row changes. Events are
+    ('begin',), ('commit', end_lsn), ('upsert', relid, row), ('delete', relid,
+    key) and ('truncate', relids); rows and keys are {column: text value}.
+    """
+    reader = MessageReader(data)
+    kind = reader.read('!c')
+
+    if kind == b'B':
+        return ('begin',)
+    if kind == b'C':
+        _, _, end_lsn, _ = reader.read('!bqqq')
+        return ('commit', end_lsn)
+    if kind == b'R':
+        relid = reader.read('!I')
+        reader.read_string()
+        table_name = reader.read_string()
+        reader.read('!b')
+        columns = []
+        key_columns = []
+        for _ in range(reader.read('!h')):
+            flags = reader.read('!b')
+            name = reader.read_string()
+            reader.read('!Ii')
+            columns.append(name)
+            if flags & 1:
+                key_columns.append(name)
+        relations[relid] = {'table_name': table_name, 'columns': columns, 'key_columns': key_columns}
+        return None
+    if kind == b'I':
+        relid = reader.read('!I')
+        reader.read('!c')
+        return ('upsert', relid, dict(zip(relations[relid]['columns'], reader.read_tuple())))
+    if kind == b'U':
+        relid = reader.read('!I')
+        relation = relations[relid]
+        old_row = None
+        tuple_kind = reader.read('!c')
+        if tuple_kind in (b'K', b'O'):
+            old_row = dict(zip(relation['columns'], reader.read_tuple()))
+            reader.read('!c')
+        new_row = dict(zip(relation['columns'], reader.read_tuple()))
+        old_key = {col: old_row[col] for col in relation['key_columns']} if old_row else None
+        if old_key and any(old_key[col] != new_row[col] for col in relation['key_columns']):
+            # The key itself changed: the row moves, so the old key must go
+            return [('delete', relid, old_key), ('upsert', relid, new_row)]
+        return ('upsert', relid, new_row)
+    if kind == b'D':
+        relid = reader.read('!I')
+        relation = relations[relid]
+        reader.read('!c')
+        old_row = dict(zip(relation['columns'], reader.read_tuple()))
+        return ('delete', relid, {col: old_row[col] for col in relation['key_columns']})
+    if kind == b'T':
+        count = reader.read('!i')
+        reader.read('!b')
+        return ('truncate', [reader.read('!I') for _ in range(count)])
+
+    # Type, origin and logical messages carry no row changes
+    return None
+
+def decode_transactions(messages, relations):
+    """Group decoded messages into committed transactions: [(end_lsn, [events])]"""
+    transactions = []
+    events = []
+    for data in messages:
+        decoded = decode_message(data, relations)
+        if decoded is None:
+            continue
+        for event in decoded if isinstance(decoded, list) else [decoded]:
+            if event[0] == 'begin':
+                events = []
+            elif event[0] == 'commit':
+                transactions.append((event[1], events))
+            else:
+                events.append(event)
+    return transactions
+
+def group_change_runs(transactions, relations, table_specs):
+    """Collapse events, in commit order, into runs of one operation on one table
+
+    Consecutive events of the same kind on the same table (and, for upserts,
+    the same columns) form a run applied in one statement batch; within a run
+    only the last change per key is kept. Events for tables outside
+    table_specs are skipped.
+    """
+    runs = []
+    for _, events in transactions:
+        for event in events:
+            if event[0] == 'truncate':
+                for relid in event[1]:
+                    table_name = relations[relid]['table_name']
+                    if table_name in table_specs:
+                        runs.append(('truncate', table_name, (), {}))
+                continue
+
+            op, relid, values = event
+            table_name = relations[relid]['table_name']
+            spec = table_specs.get(table_name)
+            if spec is None:
+                continue
+
+            if op == 'upsert':
+                values = {col: value for col, value in values.items()
+                          if col in spec['columns'] and value is not UNCHANGED_TOAST}
+                key = tuple(values.get(col) for col in spec['primary_keys'])
+            else:
+                # Delete by primary key whenever the replica identity carries it
+                if all(col in values for col in spec['primary_keys']):
+                    values = {col: values[col] for col in spec['primary_keys']}
+                key = tuple(values.values())
+                if not key:
+                    logger.warning(f"Skipping delete on {table_name} without a replica identity key")
+                    continue
+            columns = tuple(values)
+
+            if runs and runs[-1][:3] == (op, table_name, columns):
+                runs[-1][3][key] = values
+            else:
+                runs.append((op, table_name, columns, {key: values}))
+    return runs
+
+def apply_change_runs(cursor, runs, table_specs):
+    """Apply change runs in order through a cursor inside the caller's transaction"""
+    applied = 0
+    for op, table_name, columns, rows in runs:
+        if op == 'truncate':
+            cursor.execute(f"TRUNCATE {table_name}")
+        elif op == 'delete':
+            condition = ' AND '.join(f"{col} = %s" for col in columns)
+            cursor.executemany(f"DELETE FROM {table_name} WHERE {condition}", list(rows))
+        else:
+            query = generate_upsert_query(
+                table_name, [{'name': col} for col in columns], table_specs[table_name]['primary_keys']
+            )
+            execute_values(cursor, query, [tuple(row.values()) for row in rows.values()])
+        applied += len(rows)
+    return applied
+
+def consume_changes(prod_engine, stage_engine, slot_name, publication, table_specs,
+                    batch_changes=DEFAULT_CDC_BATCH_CHANGES, max_retries=DEFAULT_BATCH_RETRIES):
+    """Drain the replication slot into staging, one staging transaction per decoded batch
+
+    Changes are peeked, applied and only then confirmed by advancing the slot,
+    so a crash replays the last batch; upserts and deletes by key make that
+    harmless. Returns the number of changes applied.
+    """
+    total_changes = 0
+    while True:
+        with prod_engine.connect() as connection:
+            messages = [row[0] for row in connection.exec_driver_sql(
+                PEEK_CHANGES_QUERY, {'slot_name': slot_name, 'batch_changes': batch_changes, 'publication': publication}
+            )]
+        if not messages:
+            break
+
+        relations = {}
+        transactions = decode_transactions(messages, relations)
+        if not transactions:
+            break
+        runs = group_change_runs(transactions, relations, table_specs)
+        total_changes += run_in_transaction(
+            stage_engine, lambda cursor: apply_change_runs(cursor, runs, table_specs), slot_name, max_retries
+        )
+
+        end_lsn = format_lsn(transactions[-1][0])
+        with prod_engine.begin() as connection:
+            connection.exec_driver_sql(
+                "SELECT pg_replication_slot_advance(%(slot_name)s::name, %(end_lsn)s::pg_lsn)",
+                {'slot_name': slot_name, 'end_lsn': end_lsn}
+            )
+        logger.info(f"{slot_name}: Applied {len(transactions)} transactions up to {end_lsn}")
+
+        if len(messages) < batch_changes:
+            break
+    return total_changes
+
+def sync_cdc_tables(context, table_names):
+    """Replicate the CDC tables from the prod replication slot into staging
+
+    A table joining the publication (or every table, when the slot is new)
+    first gets an initial copy through the regular sync; changes decoded
+    since then are replayed over it. Returns {table_name: success}.
+    """
+    prod_engine = context.get_engine(os.getenv('DB_PROD_NAME'))
+    stage_engine = context.get_engine(os.getenv('DB_STAGE_NAME'))
+    slot_name = publication = CDC_SLOT_NAME
+    success_status = {table_name: False for table_name in table_names}
+
+    try:
+        # The publication must exist before the slot's start LSN: pgoutput fails on
+        # WAL decoded from before it was created
+        added = ensure_publication(prod_engine, publication, table_names)
+        created = ensure_replication_slot(prod_engine, slot_name)
+
+        failed = set()
+        for table_name in (table_names if created else added):
+            logger.info(f"Initial copy of {table_name} for CDC...")
+            try:
+                sync_table(table_name, context)
+            except Exception as e:
+                logger.error(f"Initial copy of {table_name} failed, it will be retried next run: {str(e)}")
+                drop_from_publication(prod_engine, publication, table_name)
+                failed.add(table_name)
+
+        catalog = context.get_catalog(os.getenv('DB_PROD_NAME'))
+        table_specs = {}
+        for table_name in table_names:
+            if table_name in failed:
+                continue
+            table_catalog = get_table_catalog(catalog, table_name)
+            config = context.tables[table_name]
+            table_specs[table_name] = {
+                'columns': [col['name'] for col in get_table_schema(table_catalog, table_name, config)],
+                'primary_keys': get_primary_keys(table_catalog, table_name),
+            }
+
+        applied = consume_changes(
+            prod_engine, stage_engine, slot_name, publication, table_specs,
+            batch_changes=int(os.getenv('SYNC_CDC_BATCH_CHANGES', DEFAULT_CDC_BATCH_CHANGES))
+        )
+        logger.info(f"CDC applied {applied} changes")
+        for table_name in table_specs:
+            success_status[table_name] = True
+    except Exception as e:
+        logger.error(f"CDC sync failed: {str(e)}")
+    return success_status
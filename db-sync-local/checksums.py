@@ -0,0 +1,114 @@
+from utils import logger
+from concurrent.futures import ThreadPoolExecutor
+
+# Buckets each mismatched key range is split into per level, and the bucket
+# size (rows) below which rows are compared one by one
+DEFAULT_CHECKSUM_FANOUT = 16
+DEFAULT_CHECKSUM_LEAF_ROWS = 1000
+
+# Row hashes are computed from ROW(...)::text, so both sides must render
+# values identically whatever their server or session defaults
+CHECKSUM_SESSION_SETTINGS = [
+    "SET LOCAL TimeZone = 'UTC'",
+    "SET LOCAL DateStyle = 'ISO, YMD'",
+    "SET LOCAL IntervalStyle = 'postgres'",
+    "SET LOCAL extra_float_digits = 3",
+]
+
+def row_hash_expression(columns):
+    """SQL expression hashing one row over the synced columns"""
+    return f"md5(ROW({', '.join(col['name'] for col in columns)})::text)"
+
+def run_checksum_query(engine, query, params):
+    """Run a checksum query under the shared session settings"""
+    with engine.begin() as connection:
+        for setting in CHECKSUM_SESSION_SETTINGS:
+            connection.exec_driver_sql(setting)
+        return connection.exec_driver_sql(query, params).fetchall()
+
+def get_key_bounds(engine, table_name, key_column):
+    """Get the min and max of a table's key column"""
+    query = f"SELECT min({key_column}), max({key_column}) FROM {table_name}"
+    with engine.connect() as connection:
+        return tuple(connection.exec_driver_sql(query).one())
+
+def get_bucket_checksums(engine, table_name, key_column, columns, low, high, width):
+    """Get {bucket: (row_count, hash)} for [low, high) split into buckets of `width` keys"""
+    query = f"""
+    SELECT ({key_column} - %(low)s) / %(width)s AS bucket,
+           count(*),
+           md5(string_agg({row_hash_expression(columns)}, '' ORDER BY {key_column}))
+    FROM   {table_name}
+    WHERE  {key_column} >= %(low)s AND {key_column} < %(high)s
+    GROUP  BY 1
+    """
+    rows = run_checksum_query(engine, query, {'low': low, 'width': width, 'high': high})
+    return {int(bucket): (count, digest) for bucket, count, digest in rows}
+
+def get_row_checksums(engine, table_name, key_column, columns, low, high):
+    """Get {key: hash} for every row with key in [low, high)"""
+    query = f"""
+    SELECT {key_column}, {row_hash_expression(columns)}
+    FROM   {table_name}
+    WHERE  {key_column} >= %(low)s AND {key_column} < %(high)s
+    """
+    return dict(run_checksum_query(engine, query, {'low': low, 'high': high}))
+
+def find_changed_keys(prod_engine, stage_engine, table_name, key_column, columns,
+                      fanout=DEFAULT_CHECKSUM_FANOUT, leaf_rows=DEFAULT_CHECKSUM_LEAF_ROWS):
+    """Find keys whose rows differ between prod and staging by recursive range checksums
+
+    Both databases hash the same key buckets in place; only buckets whose
+    count or hash differ are split further, and buckets small enough are
+    compared row by row. Returns (keys to copy from prod, number of keys only
+    present in staging).
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            def on_both(func, *args):
+                prod = executor.submit(func, prod_engine, *args)
+                stage = executor.submit(func, stage_engine, *args)
+                return prod.result(), stage.result()
+
+            bounds = [value for side in on_both(get_key_bounds, table_name, key_column)
+                      for value in side if value is not None]
+            if not bounds:
+                return [], 0
+
+            changed_keys = []
+            stage_only = 0
+            ranges = [(int(min(bounds)), int(max(bounds)) + 1)]
+            compared_buckets = 0
+            while ranges:
+                low, high = ranges.pop()
+                width = max(1, -(-(high - low) // fanout))
+                prod_buckets, stage_buckets = on_both(
+                    get_bucket_checksums, table_name, key_column, columns, low, high, width
+                )
+                compared_buckets += len(set(prod_buckets) | set(stage_buckets))
+
+                for bucket in set(prod_buckets) | set(stage_buckets):
+                    prod_bucket = prod_buckets.get(bucket)
+                    stage_bucket = stage_buckets.get(bucket)
+                    if prod_bucket == stage_bucket:
+                        continue
+
+                    bucket_low = low + bucket * width
+                    bucket_high = min(high, bucket_low + width)
+                    bucket_rows = max(prod_bucket[0] if prod_bucket else 0, stage_bucket[0] if stage_bucket else 0)
+                    if bucket_rows > leaf_rows and width > 1:
+                        ranges.append((bucket_low, bucket_high))
+                        continue
+
+                    prod_rows, stage_rows = on_both(
+                        get_row_checksums, table_name, key_column, columns, bucket_low, bucket_high
+                    )
+                    changed_keys.extend(key for key, digest in prod_rows.items() if stage_rows.get(key) != digest)
+                    stage_only += len(stage_rows.keys() - prod_rows.keys())
+
+        logger.info(f"Checksum diff of {table_name}: {len(changed_keys)} changed rows, "
+                    f"{stage_only} rows only in staging, {compared_buckets} buckets compared")
+        return sorted(changed_keys), stage_only
+    except Exception as e:
+        logger.error(f"Error computing checksum diff for {table_name}: {str(e)}")
+        raise
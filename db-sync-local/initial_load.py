@@ -0,0 +1,165 @@
+from utils import logger
+from metrics import run_metrics
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# Staging-side table holding the secondary indexes dropped and the triggers
+# disabled for a fast initial load. Rows are only removed once the object is
+# back, so a crashed run is repaired by the next one.
+DEFERRED_OBJECTS_TABLE = 'sync_deferred_objects'
+
+CREATE_DEFERRED_OBJECTS_TABLE_QUERY = f"""
+CREATE TABLE IF NOT EXISTS {DEFERRED_OBJECTS_TABLE} (
+    table_name  text NOT NULL,
+    object_type text NOT NULL,
+    object_name text NOT NULL,
+    definition  text,
+    deferred_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (table_name, object_type, object_name)
+)
+"""
+
+SAVE_DEFERRED_OBJECT_QUERY = f"""
+INSERT INTO {DEFERRED_OBJECTS_TABLE} (table_name, object_type, object_name, definition)
+VALUES (%(table_name)s, %(object_type)s, %(object_name)s, %(definition)s)
+"""
+
+# Non-unique indexes that back no constraint; primary keys and unique indexes
+# stay, since the merge's ON CONFLICT needs them
+SECONDARY_INDEXES_QUERY = """
+SELECT quote_ident(i.schemaname) || '.' || quote_ident(i.indexname), i.indexdef
+FROM   pg_indexes i
+JOIN   pg_index ix ON ix.indexrelid = (quote_ident(i.schemaname) || '.' || quote_ident(i.indexname))::regclass
+WHERE  ix.indrelid = %(table_name)s::regclass
+  AND  NOT ix.indisunique
+  AND  NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = ix.indexrelid)
+"""
+
+# Enabled user triggers (internal foreign key triggers are left alone)
+ENABLED_TRIGGERS_QUERY = """
+SELECT quote_ident(tgname)
+FROM   pg_trigger
+WHERE  tgrelid = %(table_name)s::regclass AND NOT tgisinternal AND tgenabled <> 'D'
+"""
+
+# Settings of every load transaction of an initial load. Watermarks commit with
+# the rows, so a crash losing the last commits only makes the next run redo them.
+INITIAL_LOAD_SETTINGS = ["SET LOCAL synchronous_commit = off"]
+
+# Indexes rebuilt at once after an initial load
+DEFAULT_INDEX_BUILD_WORKERS = 4
+
+_ensured_engines = set()
+_ensure_lock = threading.Lock()
+
+def ensure_deferred_objects_table(engine):
+    """Create the deferred objects table once per engine (concurrent CREATE IF NOT EXISTS can race)"""
+    with _ensure_lock:
+        if id(engine) in _ensured_engines:
+            return
+        with engine.begin() as connection:
+            connection.exec_driver_sql(CREATE_DEFERRED_OBJECTS_TABLE_QUERY)
+        _ensured_engines.add(id(engine))
+
+def is_table_empty(engine, table_name):
+    """Whether a staging table has no rows"""
+    with engine.connect() as connection:
+        return not connection.exec_driver_sql(f"SELECT EXISTS (SELECT 1 FROM {table_name})").scalar()
+
+def defer_indexes_and_triggers(engine, table_name):
+    """Drop a table's secondary indexes and disable its user triggers before an initial load
+
+    The index definitions (pg_indexes.indexdef) and trigger names are saved
+    in the same transaction as the DDL, so they are never lost. Returns the
+    number of objects deferred.
+    """
+    try:
+        ensure_deferred_objects_table(engine)
+        with run_metrics.span(table_name, 'defer_indexes'), engine.begin() as connection:
+            indexes = connection.exec_driver_sql(SECONDARY_INDEXES_QUERY, {'table_name': table_name}).fetchall()
+            triggers = connection.exec_driver_sql(ENABLED_TRIGGERS_QUERY, {'table_name': table_name}).fetchall()
+            for index_name, definition in indexes:
+                connection.exec_driver_sql(SAVE_DEFERRED_OBJECT_QUERY, {
+                    'table_name': table_name, 'object_type': 'index', 'object_name': index_name, 'definition': definition
+                })
+                connection.exec_driver_sql(f"DROP INDEX {index_name}")
+            for (trigger_name,) in triggers:
+                connection.exec_driver_sql(SAVE_DEFERRED_OBJECT_QUERY, {
+                    'table_name': table_name, 'object_type': 'trigger', 'object_name': trigger_name, 'definition': None
+                })
+                connection.exec_driver_sql(f"ALTER TABLE {table_name} DISABLE TRIGGER {trigger_name}")
+
+        logger.info(f"{table_name}: Initial load, dropped {len(indexes)} secondary indexes and disabled {len(triggers)} triggers")
+        return len(indexes) + len(triggers)
+    except Exception as e:
+        logger.error(f"Error deferring indexes and triggers of {table_name}: {str(e)}")
+        raise
+
+def restore_deferred_objects(engine, table_name, workers=DEFAULT_INDEX_BUILD_WORKERS):
+    """Rebuild a table's deferred indexes in parallel, re-enable its triggers and ANALYZE it
+
+    Each object's row is deleted in the transaction that restores it, so a
+    restore interrupted part way resumes with what is left. Returns the
+    number of objects restored.
+    """
+    try:
+        ensure_deferred_objects_table(engine)
+        with engine.connect() as connection:
+            deferred = connection.exec_driver_sql(
+                f"SELECT object_type, object_name, definition FROM {DEFERRED_OBJECTS_TABLE} WHERE table_name = %(table_name)s",
+                {'table_name': table_name}
+            ).fetchall()
+        if not deferred:
+            return 0
+
+        def restore(object_type, object_name, definition):
+            with engine.begin() as connection:
+                if object_type == 'index':
+                    connection.exec_driver_sql(definition)
+                else:
+                    connection.exec_driver_sql(f"ALTER TABLE {table_name} ENABLE TRIGGER {object_name}")
+                connection.exec_driver_sql(
+                    f"DELETE FROM {DEFERRED_OBJECTS_TABLE} WHERE table_name = %(table_name)s AND object_type = %(object_type)s AND object_name = %(object_name)s",
+                    {'table_name': table_name, 'object_type': object_type, 'object_name': object_name}
+                )
+
+        # Index builds share the table lock; triggers follow, since ALTER TABLE would queue behind them
+        with run_metrics.span(table_name, 'index_rebuild'):
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                futures = [executor.submit(restore, *row) for row in deferred if row[0] == 'index']
+                errors = [future.exception() for future in futures if future.exception() is not None]
+            # A failed index build does not keep the triggers disabled
+            for row in deferred:
+                if row[0] == 'trigger':
+                    try:
+                        restore(*row)
+                    except Exception as e:
+                        errors.append(e)
+            if errors:
+                raise errors[0]
+            with engine.begin() as connection:
+                connection.exec_driver_sql(f"ANALYZE {table_name}")
+
+        logger.info(f"{table_name}: Restored {len(deferred)} deferred indexes and triggers")
+        return len(deferred)
+    except Exception as e:
+        logger.error(f"Error restoring deferred indexes and triggers of {table_name}: {str(e)}")
+        raise
+
+def restore_all_deferred_objects(engine):
+    """Restore the objects every interrupted initial load left deferred on a staging database
+
+    Run at startup. A table that fails to restore is logged and retried on
+    the next run, without holding up the others.
+    """
+    ensure_deferred_objects_table(engine)
+    with engine.connect() as connection:
+        table_names = [row[0] for row in connection.exec_driver_sql(
+            f"SELECT DISTINCT table_name FROM {DEFERRED_OBJECTS_TABLE}"
+        ).fetchall()]
+    for table_name in table_names:
+        logger.warning(f"Restoring indexes and triggers an interrupted initial load of {table_name} left deferred")
+        try:
+            restore_deferred_objects(engine, table_name)
+        except Exception:
+            continue
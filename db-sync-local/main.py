@@ -1,25 +1,56 @@
 from utils import logger
-from sync_utils import sync_table, load_table_config
+from sync_utils import sync_table, SyncContext
+from scheduler import get_table_dependencies, run_table_syncs, load_scheduler_limits
+from cdc import sync_cdc_tables
+from metrics import write_run_report
+from initial_load import restore_all_deferred_objects
+import os
 
 def run_all_syncs():
     """Run all database syncs"""
     logger.info("Starting database syncs...")
     
-    # Load table configurations
-    tables = load_table_config()
-    success_status = {table_name: False for table_name in tables.keys()}
-    
-    # Sync each table
-    for table_name in tables.keys():
+    # Config is parsed once and engines are shared by every table in the run
+    with SyncContext() as context:
+        # CDC tables replay the replication slot instead of polling their check column
+        tables = {
+            table_name: config for table_name, config in context.tables.items()
+            if config['sync_config'].get('mode') != 'cdc'
+        }
+        cdc_tables = [table_name for table_name in context.tables if table_name not in tables]
+        
+        # Put back indexes and triggers an interrupted fast initial load left deferred
+        if any(config['sync_config'].get('fast_initial_load') for config in tables.values()):
+            try:
+                restore_all_deferred_objects(context.get_engine(os.getenv('DB_STAGE_NAME')))
+            except Exception as e:
+                logger.warning(f"Could not restore deferred indexes and triggers: {str(e)}")
+        
+        # Read foreign keys from staging so parents load before children
         try:
-            logger.info(f"Starting sync for {table_name}...")
-            sync_table(table_name)
-            success_status[table_name] = True
-            logger.info(f"{table_name} sync completed successfully")
+            dependencies = get_table_dependencies(context.get_catalog(os.getenv('DB_STAGE_NAME')), list(tables.keys()))
         except Exception as e:
-            logger.error(f"{table_name} sync failed: {str(e)}")
-            if table_name != list(tables.keys())[-1]:  # If not the last table
-                logger.error("Continuing with next sync...")
+            logger.warning(f"Could not read foreign keys, syncing without ordering: {str(e)}")
+            dependencies = {}
+        
+        # Sync tables concurrently, isolating failures per table
+        table_databases = {table_name: [os.getenv('DB_PROD_NAME'), *context.get_stage_targets()] for table_name in tables}
+        success_status = run_table_syncs(
+            tables,
+            lambda table_name: sync_table(table_name, context),
+            dependencies,
+            table_databases,
+            **load_scheduler_limits()
+        )
+        
+        if cdc_tables:
+            success_status.update(sync_cdc_tables(context, cdc_tables))
+    
+    # Per-table stage timings and counters, for comparing runs
+    try:
+        write_run_report()
+    except Exception as e:
+        logger.warning(f"Could not write the run report: {str(e)}")
     
     # Report final status
     if all(success_status.values()):
@@ -0,0 +1,24 @@
+"""Keyset cursors advanced over extracted chunks"""
+import pandas as pd
+
+from watermarks import chunk_watermark
+from sync_utils import generate_watermark_condition
+
+def test_ordered_chunk_takes_last_row():
+    # en_US sorts 's10' before 'S2'; Python's byte order would pick 's10' as the max
+    chunk = pd.DataFrame({'date_added': ['2021-01-01', '2021-01-01'], 'show_id': ['s10', 'S2']})
+    watermark = chunk_watermark(chunk, 'date_added', ['show_id'], ordered=True)
+    assert watermark['check_value'] == '2021-01-01'
+    assert watermark['key_values'] == ['S2']
+
+def test_ordered_chunk_skips_null_check_values():
+    chunk = pd.DataFrame({'id': [1, 2, None]})
+    watermark = chunk_watermark(chunk, 'id', [], ordered=True)
+    assert watermark['check_value'] == 2
+    assert watermark['key_values'] == []
+
+def test_empty_key_values_stay_exclusive():
+    # Check column that is the whole primary key: no tie-breaker columns
+    condition, params = generate_watermark_condition('id', {'check_value': 5, 'key_values': []}, [])
+    assert condition == "(id) > (%(watermark_0)s)"
+    assert params == {'watermark_0': 5}